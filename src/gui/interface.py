@@ -1,10 +1,11 @@
 # mapping from status keys to display texts
+import inspect
 import sys
 import os
 
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QFrame, QLineEdit, QSizePolicy,
-    QPushButton, QFileDialog, QMessageBox
+    QPushButton, QFileDialog, QMessageBox, QComboBox
 )
 from PyQt6.QtCore import Qt, QUrl, QThread, pyqtSignal
 from PyQt6.QtGui import QIcon
@@ -13,32 +14,63 @@ from PyQt6.QtCore import QSize
 
 
 from ..sticker_tools.patch_duration import patch_duration
-from ..sticker_tools.convert_optimize import convert_optimize, cleanup
+from ..sticker_tools.pipeline import make_sticker
+from ..sticker_tools.cancel import CancelToken, Cancelled
+from ..sticker_tools.profiles import DEFAULT_PROFILE, profile_names
 
 
 class WorkerThread(QThread):
     # signal: status key, error message (None on success)
     finished = pyqtSignal(str, object)
     progress = pyqtSignal(int)
+    # signal: ProgressEvent of the running ffmpeg
+    encode_progress = pyqtSignal(object)
 
-    def __init__(self, func, *args):
+    def __init__(self, func, *args, events=False, cancellable=False, **options):
         super().__init__()
         self.func = func
         self.args = args
+        # extra keyword arguments of func (e.g. the encoder profile)
+        self.options = options
+        # pass an event_callback for fine-grained ffmpeg progress
+        self.events = events
+        # pass a cancel token, so the job (and its ffmpeg) can be stopped
+        self.cancel_token = CancelToken() if cancellable else None
+        # names of the keyword arguments func takes, None if it takes any
+        parameters = inspect.signature(func).parameters.values()
+        if any(parameter.kind is parameter.VAR_KEYWORD for parameter in parameters):
+            self.accepted = None
+        else:
+            self.accepted = {parameter.name for parameter in parameters}
+
+    def cancel(self):
+        """Stop the job, killing the running ffmpeg."""
+        if self.cancel_token is not None:
+            self.cancel_token.cancel()
 
     def _on_progress(self, value: int):
         """Emit progress updates to the main thread."""
         self.progress.emit(value)
 
+    def _on_event(self, event):
+        """Emit ffmpeg progress events to the main thread."""
+        self.encode_progress.emit(event)
+
     def run(self):
         try:
-            # call function, providing progress callback if supported
-            try:
-                self.func(*self.args, progress_callback=self._on_progress)
-            except TypeError:
-                # fallback if the function doesn't accept progress_callback
-                self.func(*self.args)
-            self.finished.emit("success", None)
+            # call function, providing the callbacks and the cancel token it supports
+            hooks = dict(progress_callback=self._on_progress)
+            if self.events:
+                hooks["event_callback"] = self._on_event
+            if self.cancel_token is not None:
+                hooks["cancel"] = self.cancel_token
+            if self.accepted is not None:
+                hooks = {name: value for name, value in hooks.items() if name in self.accepted}
+            result = self.func(*self.args, **hooks, **self.options)
+            # a stopped job reports "cancelled" or "timeout" (the best encode so far was kept)
+            self.finished.emit(getattr(result, "status", "success"), None)
+        except Cancelled:
+            self.finished.emit("cancelled", None)
         except Exception as e:
             self.finished.emit("error", e)
 
@@ -49,6 +81,30 @@ STATUS_DESCRIPTIONS = {
  "processing": "Працюю над наліпкою, зачекайте...",
  "success": "Готово!\nМожете завантажити ще один файл",
  "error": "Ой-ой, щось пішло не так...",
+ "cancelled": "Скасовано.\nЯкщо якась спроба вже вклалась у ліміт, її збережено",
+ "timeout": "Час вичерпано.\nЗбережено найкращу спробу, що вклалась у ліміт",
+ "over_target": "Не вдалося вкластися у ліміт розміру.\nЗбережено найменшу спробу",
+}
+
+# statuses without an animation of their own borrow one
+STATUS_ANIMATIONS = {
+ "cancelled": "waiting_for_command",
+ "timeout": "success",
+ "over_target": "error",
+}
+
+# encoder profiles as shown in the selector
+PROFILE_LABELS = {
+ "draft": "Чернетка (швидко)",
+ "balanced": "Збалансовано",
+ "archival": "Найкраща якість",
+ "tuned": "Підібрано для цього ПК",
+}
+
+ENCODE_STAGES = {
+ "mezzanine": "Підготовка",
+ "analysis": "Аналіз",
+ "encode": "Кодування",
 }
 
 NAME = "Українська Класика"
@@ -173,18 +229,29 @@ class FilePatcherApp(QWidget):
             progress_bar.addWidget(light, alignment=Qt.AlignmentFlag.AlignVCenter)
         layout.addLayout(progress_bar)
 
+        # encoder profile of conversions
+        self.profile_box = QComboBox(self)
+        for name in profile_names():
+            self.profile_box.addItem(PROFILE_LABELS.get(name, name), name)
+        self.profile_box.setCurrentIndex(self.profile_box.findData(DEFAULT_PROFILE))
+        layout.addWidget(self.profile_box)
+
         # buttons
         self.btn_patch = QPushButton("Пропатчити")
         self.btn_convert_patch = QPushButton("Конвертувати + Пропатчити")
+        self.btn_cancel = QPushButton("Скасувати")
         layout.addWidget(self.btn_patch)
         layout.addWidget(self.btn_convert_patch)
+        layout.addWidget(self.btn_cancel)
 
         # disable both buttons initially
         self.btn_patch.setEnabled(False)
         self.btn_convert_patch.setEnabled(False)
+        self.btn_cancel.setEnabled(False)
 
         self.btn_patch.clicked.connect(self.do_patch)
         self.btn_convert_patch.clicked.connect(self.do_convert_and_patch)
+        self.btn_cancel.clicked.connect(self.cancel_conversion)
 
         # update buttons when a file is selected or changed
         self.file_edit.textChanged.connect(self._update_buttons_state)
@@ -203,6 +270,7 @@ class FilePatcherApp(QWidget):
         # disable buttons while working
         self.btn_patch.setEnabled(False)
         self.btn_convert_patch.setEnabled(False)
+        self.btn_cancel.setEnabled(False)
         self.set_progress(0)
         worker = WorkerThread(patch_duration, path)
         worker.finished.connect(self._on_worker_finished)
@@ -220,18 +288,21 @@ class FilePatcherApp(QWidget):
         self.set_status("processing")
         self.btn_patch.setEnabled(False)
         self.btn_convert_patch.setEnabled(False)
+        self.btn_cancel.setEnabled(False)
         self.set_progress(0)
-        def task_convert_and_patch(p, progress_callback=None):
-            output = os.path.splitext(p)[0] + ".webm"
-            convert_optimize(p, progress_callback=progress_callback)
-            patch_duration(output)
-            cleanup(os.path.dirname(output))
-        worker = WorkerThread(task_convert_and_patch, path)
+        # conversion intermediates live in a per-job scratch directory,
+        # so no directory-wide cleanup is needed afterwards
+        worker = WorkerThread(make_sticker, path, events=True, cancellable=True,
+                              profile=self.profile_box.currentData())
         worker.finished.connect(self._on_worker_finished)
         # update status based on worker result
         worker.finished.connect(lambda status, err: self.set_status(status))
         # connect progress signal to update progress lights
         worker.progress.connect(self.set_progress)
+        # show frame-level progress of the running encode
+        worker.encode_progress.connect(self.show_encode_progress)
+        self._conversion = worker
+        self.btn_cancel.setEnabled(True)
         # clean up thread object when done
         worker.finished.connect(worker.deleteLater)
         self._workers.append(worker)
@@ -283,7 +354,10 @@ class FilePatcherApp(QWidget):
         if hasattr(self, "file_edit"):
             self.file_edit.setEnabled(status != "processing")
         # load and loop the corresponding GIF animation
-        gif_path = os.path.join(self._base_dir, "status_animations", f"{status}.gif")
+        animation = STATUS_ANIMATIONS.get(status, status)
+        gif_path = os.path.join(self._base_dir, "status_animations", f"{animation}.gif")
+        if not os.path.exists(gif_path):
+            gif_path = os.path.join(self._base_dir, "status_animations", "waiting_for_command.gif")
         movie = QMovie(gif_path)
         movie.setCacheMode(QMovie.CacheMode.CacheAll)
         fm = self.fontMetrics()
@@ -292,7 +366,17 @@ class FilePatcherApp(QWidget):
         self.status_movie_label.setMovie(movie)
         movie.start()
 
+    def cancel_conversion(self):
+        """Stop the running conversion."""
+        worker = getattr(self, "_conversion", None)
+        if worker is not None:
+            worker.cancel()
+            self.btn_cancel.setEnabled(False)
+            self.status_desc.setText("Зупиняю...")
+
     def _on_worker_finished(self, status, err):
+        self._conversion = None
+        self.btn_cancel.setEnabled(False)
         self.set_status(status)
         # re-enable buttons after processing
         self._update_buttons_state(self.file_edit.text())
@@ -307,6 +391,14 @@ class FilePatcherApp(QWidget):
                      ) + str(err)
             QMessageBox.critical(self, "Помилка", error_text)
 
+    def show_encode_progress(self, event):
+        """Show the progress of the running ffmpeg pass in the status text."""
+        stage = ENCODE_STAGES.get(event.stage, event.stage)
+        if event.iteration:
+            stage = f"{stage} {event.iteration}"
+        total = f"/{event.total_frames}" if event.total_frames else ""
+        self.status_desc.setText(f"{stage}: кадр {event.frame}{total}, {event.fps:.0f} fps")
+
     def set_progress(self, count: int):
         """Light up the first `count` progress steps."""
         total = len(self._progress_steps)
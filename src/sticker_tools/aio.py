@@ -0,0 +1,285 @@
+import asyncio
+import logging
+import os
+import subprocess
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict
+
+from .bitrate_memo import BitrateMemo, warm_start
+from .convert_optimize import (vp9_command, mezzanine_command, get_scalecrop_filter, estimate_bitrate,
+                               output_frames, scratch_size, OvershootGuard)
+from .patch_duration import patch_duration
+from .pipeline import JobResult, check_sticker
+from .probe import MediaInfo, ffprobe_command, parse_ffprobe, cache_key, cached, remember
+from .process import _hide_window
+from .progress import ProgressEvent, reporter
+from .rate_control import searcher, Sample, SearchResult, fallback_bitrate
+from .scratch import job_scratch, promote, scratch_root
+from .storage import file_digest
+
+logging.basicConfig(level=logging.INFO)
+
+# ffmpeg/ffprobe processes running at once across all async jobs of the process
+DEFAULT_CONCURRENCY = max(1, (os.cpu_count() or 1) // 2)
+
+_limit = DEFAULT_CONCURRENCY
+# a semaphore is bound to the loop it's first used in, so every running loop gets its own
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def set_concurrency(limit: int) -> None:
+    """
+    Sets how many ffmpeg/ffprobe processes the async API runs at once in
+    each event loop. Jobs over the limit wait for a slot between their
+    passes. Processes already running keep their slots.
+    """
+    global _limit
+    _limit = max(1, limit)
+    _semaphores.clear()
+
+
+def _slots() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(_limit)
+    return semaphore
+
+
+async def _read_progress(stream: asyncio.StreamReader) -> AsyncIterator[Dict[str, str]]:
+    # async twin of progress.read_progress
+    block = {}
+    async for line in stream:
+        key, sep, value = line.decode(errors="replace").strip().partition("=")
+        if not sep:
+            continue
+        block[key] = value
+        if key == "progress":
+            yield block
+            block = {}
+
+
+async def run_async(cmd, on_progress: Callable[[Dict[str, str]], bool] = None, capture: bool = False):
+    """
+    Runs a command as a child process without blocking the event loop, in
+    one of the shared process slots (see `set_concurrency`).
+
+    With `on_progress` the ffmpeg command gets `-progress pipe:1` and every
+    progress block is passed to the callback; returning True kills the
+    process. Cancelling the awaiting task kills the process as well and
+    waits for it to exit before the cancellation propagates.
+
+    :param cmd: command line
+    :param on_progress: ffmpeg progress callback, see `progress.run_with_progress`
+    :param capture: return the decoded stdout
+    :return: stdout if `capture`, otherwise True if the process ran to completion
+    """
+    if on_progress is not None:
+        cmd = [cmd[0], '-progress', 'pipe:1', '-nostats'] + list(cmd[1:])
+    stdout = subprocess.PIPE if capture or on_progress is not None else subprocess.DEVNULL
+    async with _slots():
+        process = await asyncio.create_subprocess_exec(*cmd, stdout=stdout, stderr=subprocess.DEVNULL,
+                                                       **_hide_window({}))
+        stopped = False
+        try:
+            if capture:
+                output, _ = await process.communicate()
+            else:
+                output = None
+                if on_progress is not None:
+                    async for block in _read_progress(process.stdout):
+                        if on_progress(block):
+                            stopped = True
+                            process.kill()
+                            break
+                await process.wait()
+        except BaseException:
+            if process.returncode is None:
+                process.kill()
+                await asyncio.shield(process.wait())
+            raise
+    if not stopped and process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+    return output.decode() if capture else not stopped
+
+
+async def probe_async(path: str) -> MediaInfo:
+    """
+    Async `probe.probe`, sharing its memo.
+    """
+    key = cache_key(path)
+    info = cached(key)
+    if info is None:
+        info = parse_ffprobe(path, await run_async(ffprobe_command(path), capture=True))
+        remember(key, info)
+    return info
+
+
+@asynccontextmanager
+async def _job_scratch(output_path: str, root: str = None) -> AsyncIterator[str]:
+    # `scratch.job_scratch` with its mkdtemp and rmtree off the event loop
+    scratch = job_scratch(output_path, root)
+    path = await asyncio.to_thread(scratch.__enter__)
+    try:
+        yield path
+    finally:
+        await asyncio.to_thread(scratch.__exit__, None, None, None)
+
+
+async def convert_async(input_path: str, target_size_kb: float = 255, accuracy_kb: float = 5,
+                        strategy="model", max_encodes: int = 10, threads: int = 0, memo: bool = True,
+                        mezzanine: str = "ffv1", sink: str = "ram", early_abort: bool = True,
+                        event_callback: Callable[[ProgressEvent], None] = None, profile: str = None) -> SearchResult:
+    """
+    Coroutine version of `convert_optimize`: the same search over the same
+    ffmpeg commands, with every child process awaited instead of blocking a
+    thread. Proxy calibration and segmented encoding are only available in
+    the blocking API.
+
+    Cancelling the task kills the running ffmpeg and removes the job's
+    scratch directory; an existing output file is left untouched.
+
+    :param event_callback: receives the ProgressEvents of every ffmpeg pass
+    :param profile: encoder profile (see `profiles`)
+    :return: SearchResult
+    """
+    logger = logging.getLogger("aio")
+    output_path = os.path.splitext(input_path)[0] + ".webm"
+    options = dict(threads=threads, profile=profile)
+
+    def watch(stage, total_frames, iteration=0, guard=None):
+        if event_callback is None:
+            return guard
+        return reporter(event_callback, stage, iteration, total_frames, guard)
+
+    info = await probe_async(input_path)
+    root = await asyncio.to_thread(scratch_root, sink, scratch_size(info, mezzanine, target_size_kb, max_encodes))
+    async with _job_scratch(output_path, root) as scratch:
+        passlog = os.path.join(scratch, "analysis")
+
+        duration = info.duration
+        frames = output_frames(info)
+        if mezzanine:
+            cmd, source, _ = mezzanine_command(input_path, scratch, info, mezzanine)
+            await run_async(cmd, watch("mezzanine", frames))
+        else:
+            source = input_path
+            options["filters"] = get_scalecrop_filter(info)
+
+        def trial_path(iteration):
+            # every trial keeps its own file, the chosen one is promoted without re-encoding
+            return os.path.join(scratch, f"trial{iteration:02d}.webm")
+
+        async def encode(iteration, vid_bps, abortable=early_abort) -> Sample:
+            guard = OvershootGuard(target_size_kb, frames) if abortable else None
+            on_progress = watch("encode", frames, iteration, guard)
+            cmd = vp9_command(2, source, trial_path(iteration), vid_bps, passlog, **options)
+            started = time.perf_counter()
+            if not await run_async(cmd, on_progress):
+                return Sample(vid_bps, guard.projected_kb, partial=True, seconds=time.perf_counter() - started)
+            return Sample(vid_bps, os.path.getsize(trial_path(iteration)) / 1024,
+                          seconds=time.perf_counter() - started)
+
+        test_bitrate = estimate_bitrate(duration, target_size_kb)
+        if memo:
+            bitrate_memo = BitrateMemo(profile=profile, mezzanine=mezzanine)
+            digest = await asyncio.to_thread(file_digest, input_path)
+            known = await asyncio.to_thread(bitrate_memo.samples_for, input_path, info, digest)
+            remembered = warm_start(known, target_size_kb, accuracy_kb)
+            test_bitrate = remembered or test_bitrate
+
+        logger.info(f"Analyzing {input_path} (first pass) ...")
+        await run_async(vp9_command(1, source, os.path.join(scratch, "analysis.webm"), test_bitrate, passlog,
+                                    **options),
+                        watch("analysis", frames))
+
+        steps = searcher(test_bitrate, target_size_kb, accuracy_kb, strategy, max_encodes)
+        try:
+            iteration, bitrate = next(steps)
+            while True:
+                iteration, bitrate = steps.send(await encode(iteration, bitrate))
+        except StopIteration as stop:
+            result = stop.value
+
+        if result.chosen is None:
+            # every trial was aborted over the target: finish one below them without the guard
+            bitrate = fallback_bitrate(result.samples, target_size_kb, accuracy_kb)
+            result.settle(await encode(len(result.samples) + 1, bitrate, abortable=False),
+                          target_size_kb, accuracy_kb)
+        await asyncio.to_thread(promote, trial_path(result.chosen + 1), output_path)
+        if memo:
+            await asyncio.to_thread(bitrate_memo.record, input_path, info, result.samples, digest)
+
+    logger.info(f"Optimal bitrate: {result.bitrate / 1000:.2f} kbps, final size: {result.size_kb:.2f} kb, "
+                f"used {result.encodes} encodes")
+    return result
+
+
+async def make_sticker_async(input_path: str, target_size_kb: float = 255, accuracy_kb: float = 5,
+                             **options) -> JobResult:
+    """
+    Async `pipeline.make_sticker` without the result cache: converts (a
+    .webm input is only checked, see `pipeline.check_sticker`) and patches
+    the duration. File system work runs in worker threads, off the event loop.
+
+    :param options: passed to `convert_async`
+    :return: JobResult, errors are raised
+    """
+    started = time.perf_counter()
+    output_path = os.path.splitext(input_path)[0] + ".webm"
+    result = JobResult(input_path, output_path)
+    if os.path.splitext(input_path)[1].lower() != ".webm":
+        search_result = await convert_async(input_path, target_size_kb, accuracy_kb, **options)
+        result.bitrate = search_result.bitrate
+        result.encodes = search_result.encodes
+        result.history = search_result.history()
+        if search_result.size_kb >= target_size_kb:
+            result.status = "over_target"
+            result.error = f"no encode fit under {target_size_kb} kb, kept the smallest"
+    else:
+        await asyncio.to_thread(check_sticker, input_path)
+    await asyncio.to_thread(patch_duration, output_path)
+    result.size_kb = os.path.getsize(output_path) / 1024
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+class StickerJob:
+    """
+    A running `make_sticker_async` task with an async iterator over its
+    progress. Awaiting the job gives the JobResult, `cancel` stops it and
+    kills its ffmpeg.
+
+        job = StickerJob("clip.mp4")
+        async for event in job:
+            print(event.stage, event.frame, event.total_frames)
+        result = await job
+
+    :param input_path: file to process
+    :param options: passed to `make_sticker_async`
+    """
+
+    def __init__(self, input_path: str, **options):
+        self.input_path = input_path
+        self._events = asyncio.Queue()
+        self.task = asyncio.create_task(make_sticker_async(input_path, event_callback=self._events.put_nowait,
+                                                           **options))
+        self.task.add_done_callback(lambda task: self._events.put_nowait(None))
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        while True:
+            event = await self._events.get()
+            if event is None:
+                return
+            yield event
+
+    def __await__(self):
+        return self.task.__await__()
+
+    def cancel(self) -> bool:
+        return self.task.cancel()
@@ -0,0 +1,119 @@
+import glob
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterable, Iterator, List, Tuple
+
+from .cancel import Cancelled
+from .journal import Journal, is_finished, recorded_samples
+from .pipeline import JobResult, make_sticker
+from .progress import ProgressPrinter
+
+logging.basicConfig(level=logging.INFO)
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv")
+# libvpx-vp9 on a 512x512 frame splits into at most 2 tile columns and 8
+# superblock rows, so with -row-mt a single encode stops scaling at a few threads
+DEFAULT_THREADS_PER_JOB = 4
+
+
+def expand_inputs(paths: Iterable[str]) -> List[str]:
+    """
+    Turns command line arguments into a list of files. Arguments may be files,
+    glob patterns or directories; directories contribute their source videos
+    (not the .webm files, which are conversion outputs).
+
+    :param paths: files, globs or directories
+    :return: de-duplicated list of files in argument order
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith(VIDEO_EXTENSIONS)
+            )
+        elif os.path.exists(path):
+            found = [path]
+        else:
+            found = sorted(p for p in glob.glob(path) if os.path.isfile(p))
+            if not found:
+                raise FileNotFoundError(f"Input file not found: {path}")
+        files.extend(found)
+    return list(dict.fromkeys(files))
+
+
+def plan_workers(job_count: int, jobs: int = 0, threads: int = 0) -> Tuple[int, int]:
+    """
+    Splits the cores between parallel conversions and ffmpeg threads so that
+    `workers * threads` doesn't oversubscribe the machine.
+
+    :param job_count: number of files to process
+    :param jobs: requested number of parallel conversions, 0 for automatic
+    :param threads: requested encoder threads per conversion, 0 for automatic
+    :return: (workers, threads per ffmpeg)
+    """
+    cores = os.cpu_count() or 1
+    if not threads:
+        threads = max(1, cores // jobs) if jobs else min(DEFAULT_THREADS_PER_JOB, cores)
+    if not jobs:
+        jobs = max(1, cores // threads)
+    return max(1, min(jobs, job_count)), threads
+
+
+def run_batch(files: List[str], jobs: int = 0, threads: int = 0, progress: str = None, journal: str = None,
+              **options) -> Iterator[JobResult]:
+    """
+    Runs `make_sticker` over `files` in a pool of worker processes and yields
+    the results as they complete. A failing file doesn't stop the batch, its
+    result carries the error instead.
+
+    :param files: files to process
+    :param jobs: parallel conversions, 0 for automatic
+    :param threads: encoder threads per conversion, 0 for automatic
+    :param progress: print ffmpeg progress of every file to stderr, "line" or "json" (see `ProgressPrinter`)
+    :param journal: `journal.Journal` file to record the job states in. If it exists, files it shows
+        finished (with the output still matching) are yielded as `resumed` results without running, and
+        interrupted files start their bitrate search from the trial encodes recorded so far
+    :param options: passed to `make_sticker`, or with `targets` to `variants.make_variants`, whose
+        results are yielded one by one
+    """
+    logger = logging.getLogger("batch")
+    workers, threads = plan_workers(len(files), jobs, threads)
+    logger.info(f"Processing {len(files)} files with {workers} workers x {threads} ffmpeg threads")
+    job = make_sticker
+    if options.get("targets"):
+        if journal:
+            raise ValueError("The journal only covers single outputs, not targets")
+        from .variants import make_variants as job
+    states = {}
+    if journal:
+        log = Journal(journal)
+        states = log.replay()
+        log.repair()
+        options["journal"] = journal
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for path in files:
+            state = states.get(os.path.abspath(path))
+            if is_finished(path, state):
+                logger.info(f"{path} was finished by an earlier run, skipping")
+                yield JobResult(path, state["output"], size_kb=state["size_kb"], bitrate=state.get("bitrate"),
+                                resumed=True)
+                continue
+            if journal:
+                options["prior_samples"] = recorded_samples(path, state)
+            if progress:
+                options["event_callback"] = ProgressPrinter(progress, label=path)
+            futures[pool.submit(job, path, threads=threads, **options)] = (path, time.perf_counter())
+        for future in as_completed(futures):
+            path, submitted = futures[future]
+            try:
+                result = future.result()
+                yield from result if isinstance(result, list) else [result]
+            except Exception as e:
+                output_path = os.path.splitext(path)[0] + ".webm"
+                status = e.reason if isinstance(e, Cancelled) else "error"
+                yield JobResult(path, output_path, status=status, error=str(e),
+                                seconds=time.perf_counter() - submitted)
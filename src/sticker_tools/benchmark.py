@@ -0,0 +1,247 @@
+import argparse
+import ast
+import json
+import logging
+import os
+import platform
+import shutil
+import time
+from dataclasses import dataclass, asdict, field
+from pathlib import Path
+from typing import Dict, List
+
+from .convert_optimize import convert_optimize, ffmpeg_version
+from .patch_duration import patch_duration
+from .process import run
+from .storage import data_dir
+from . import trace
+
+logging.basicConfig(level=logging.INFO)
+
+# test clip shipped in the repository root
+BUNDLED_CLIP = Path(__file__).resolve().parents[2] / "test_video.mp4"
+
+# synthetic clips: name -> (lavfi source, extra filters, seconds); all generated offline by ffmpeg
+SYNTHETIC_CLIPS: Dict[str, tuple] = {
+    "static": ("smptebars=s=512x512:r=30", None, 3),
+    "motion": ("testsrc2=s=512x512:r=30", None, 3),
+    "noisy": ("smptebars=s=512x512:r=30", "noise=alls=60:allf=t+u", 3),
+    "cellular": ("life=s=512x512:r=30:mold=10:ratio=0.1:death_color=#C83232:life_color=#00ff00", None, 3),
+    "wide": ("testsrc2=s=1280x720:r=30", None, 3),
+    "tall": ("testsrc2=s=480x854:r=30", None, 3),
+    "fps60": ("testsrc2=s=512x512:r=60", None, 3),
+    "short": ("testsrc2=s=512x512:r=30", None, 1),
+    "long": ("testsrc2=s=512x512:r=30", None, 10),
+    "longest": ("testsrc2=s=512x512:r=30", "noise=alls=20:allf=t", 20),
+}
+
+
+@dataclass(slots=True)
+class BenchResult:
+    """
+    Measurements of converting and patching one clip.
+
+    :param clip: name of the clip
+    :param seconds: wall time of the conversion
+    :param encodes: trial encodes used by the search
+    :param seconds_per_encode: mean wall time of a second pass
+    :param size_kb: size of the sticker
+    :param size_error_kb: target size minus the final size (negative means over the target)
+    :param converged: True if the search ended inside the accuracy window
+    :param patch_seconds: wall time of the duration patch
+    :param stages: total wall time per traced stage (ffprobe, mezzanine, pass1, pass2, ...)
+    :param error: error message if the clip failed
+    """
+    clip: str
+    seconds: float = 0.0
+    encodes: int = 0
+    seconds_per_encode: float = 0.0
+    size_kb: float = 0.0
+    size_error_kb: float = 0.0
+    converged: bool = False
+    patch_seconds: float = 0.0
+    stages: Dict[str, float] = field(default_factory=dict)
+    error: str = None
+
+
+def generate_clip(name: str, directory: str) -> str:
+    """
+    Renders a synthetic clip of SYNTHETIC_CLIPS with ffmpeg's lavfi sources,
+    unless it's already there from an earlier run.
+
+    :return: path of the clip
+    """
+    source, filters, seconds = SYNTHETIC_CLIPS[name]
+    path = os.path.join(directory, f"{name}.mp4")
+    if os.path.exists(path):
+        return path
+    os.makedirs(directory, exist_ok=True)
+    cmd = ['ffmpeg', '-v', 'error', '-hide_banner', '-f', 'lavfi', '-i', f"{source}:d={seconds}"]
+    if filters:
+        cmd += ['-vf', filters]
+    cmd += ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '16', '-pix_fmt', 'yuv420p',
+            '-an', '-y', path + ".part.mp4"]
+    run(cmd)
+    os.replace(path + ".part.mp4", path)
+    return path
+
+
+def bench_clip(name: str, source: str, directory: str, target_size_kb: float = 255, accuracy_kb: float = 5,
+               **options) -> BenchResult:
+    """
+    Converts and patches a copy of `source` in `directory` and measures it.
+    The bitrate memo is off, so every run starts from the same cold guess.
+
+    :param options: passed to `convert_optimize` (strategy, mezzanine, segments, ...)
+    """
+    result = BenchResult(name)
+    work = os.path.join(directory, name + os.path.splitext(source)[1])
+    shutil.copyfile(source, work)
+    output_path = os.path.splitext(work)[0] + ".webm"
+    options.setdefault("memo", False)
+    try:
+        with trace.tracing() as tracer:
+            started = time.perf_counter()
+            search_result = convert_optimize(work, target_size_kb, accuracy_kb, **options)
+            result.seconds = time.perf_counter() - started
+            started = time.perf_counter()
+            patch_duration(output_path)
+            result.patch_seconds = time.perf_counter() - started
+    except Exception as e:
+        result.error = str(e)
+        return result
+    finally:
+        os.remove(work)
+
+    encodes = [r["wall"] for r in tracer.records if r["name"] == "pass2"]
+    for record in tracer.records:
+        if record["kind"] == "span":
+            result.stages[record["name"]] = result.stages.get(record["name"], 0.0) + record["wall"]
+    result.encodes = search_result.encodes
+    result.seconds_per_encode = sum(encodes) / len(encodes) if encodes else 0.0
+    result.size_kb = os.path.getsize(output_path) / 1024
+    result.size_error_kb = target_size_kb - result.size_kb
+    result.converged = search_result.converged
+    os.remove(output_path)
+    return result
+
+
+def run_benchmark(clips: List[str] = None, directory: str = None, target_size_kb: float = 255,
+                  accuracy_kb: float = 5, repeat: int = 1, **options) -> dict:
+    """
+    Runs the benchmark over the bundled clip and the synthetic clips.
+
+    :param clips: names to run ("bundled" and keys of SYNTHETIC_CLIPS), all by default
+    :param directory: where clips are generated and converted, the data directory by default
+    :param repeat: runs per clip
+    :param options: passed to `convert_optimize`
+    :return: report with the environment, the settings, every result and totals
+    """
+    logger = logging.getLogger("benchmark")
+    directory = directory or os.path.join(data_dir(), "benchmark")
+    os.makedirs(directory, exist_ok=True)
+    names = clips or ["bundled"] + list(SYNTHETIC_CLIPS)
+    results = []
+    for name in names:
+        if name == "bundled":
+            source = str(BUNDLED_CLIP)
+        elif name in SYNTHETIC_CLIPS:
+            source = generate_clip(name, os.path.join(directory, "clips"))
+        else:
+            raise ValueError(f"Unknown clip: {name}. Use bundled or one of {', '.join(SYNTHETIC_CLIPS)}")
+        for _ in range(repeat):
+            logger.info(f"Benchmarking {name}")
+            results.append(bench_clip(name, source, directory, target_size_kb, accuracy_kb, **dict(options)))
+
+    done = [r for r in results if not r.error]
+    totals = dict(
+        clips=len(results),
+        failed=len(results) - len(done),
+        seconds=sum(r.seconds for r in done),
+        encodes=sum(r.encodes for r in done),
+        converged=sum(r.converged for r in done),
+        mean_size_error_kb=sum(r.size_error_kb for r in done) / len(done) if done else 0.0,
+        over_target=sum(r.size_error_kb < 0 for r in done),
+    )
+    totals["seconds_per_encode"] = totals["seconds"] / totals["encodes"] if totals["encodes"] else 0.0
+    return dict(
+        created=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        machine=dict(platform=platform.platform(), python=platform.python_version(), cpus=os.cpu_count(),
+                     ffmpeg=ffmpeg_version()),
+        settings=dict(target_size_kb=target_size_kb, accuracy_kb=accuracy_kb, repeat=repeat, **options),
+        results=[asdict(r) for r in results],
+        totals=totals,
+    )
+
+
+def format_report(report: dict) -> str:
+    """
+    Human-readable table of a benchmark report.
+    """
+    lines = [f"{'clip':<10} {'seconds':>8} {'encodes':>7} {'s/enc':>6} {'size kb':>8} {'error':>7}  status",
+             "-" * 60]
+    for r in report["results"]:
+        status = f"error: {r['error']}" if r["error"] else ("ok" if r["converged"] else "not converged")
+        lines.append(f"{r['clip']:<10} {r['seconds']:>8.1f} {r['encodes']:>7} {r['seconds_per_encode']:>6.1f} "
+                     f"{r['size_kb']:>8.1f} {r['size_error_kb']:>7.1f}  {status}")
+    t = report["totals"]
+    lines.append("-" * 60)
+    lines.append(f"{t['clips']} clips, {t['failed']} failed, {t['seconds']:.1f} s, {t['encodes']} encodes "
+                 f"({t['seconds_per_encode']:.1f} s each), {t['converged']} converged, "
+                 f"mean size error {t['mean_size_error_kb']:.1f} kb, {t['over_target']} over the target")
+    return "\n".join(lines)
+
+
+def compare(report: dict, baseline: dict) -> str:
+    """
+    Differences of the totals and per-clip times of `report` against an earlier report.
+    """
+    lines = []
+    for key in ("seconds", "encodes", "seconds_per_encode", "converged", "mean_size_error_kb", "over_target"):
+        before, after = baseline["totals"].get(key, 0), report["totals"].get(key, 0)
+        change = f" ({(after - before) / before:+.1%})" if before else ""
+        lines.append(f"{key}: {before:.2f} -> {after:.2f}{change}")
+    earlier = {r["clip"]: r for r in baseline["results"] if not r["error"]}
+    for r in report["results"]:
+        old = earlier.get(r["clip"])
+        if old and not r["error"] and old["seconds"]:
+            lines.append(f"{r['clip']}: {old['seconds']:.1f} s -> {r['seconds']:.1f} s "
+                         f"({(r['seconds'] - old['seconds']) / old['seconds']:+.1%}), "
+                         f"{old['encodes']} -> {r['encodes']} encodes")
+    return "\n".join(lines)
+
+
+def _option(text: str):
+    key, sep, value = text.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"Expected KEY=VALUE, got {text}")
+    try:
+        value = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        pass
+    return key, value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="sticker-bench",
+        description="Benchmark the conversion pipeline on the bundled and synthetic clips.",
+    )
+    parser.add_argument("clips", nargs="*", help=f"clips to run: bundled, {', '.join(SYNTHETIC_CLIPS)} (default: all)")
+    parser.add_argument("-o", "--output", metavar="FILE", help="save the report as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="compare with a report saved earlier")
+    parser.add_argument("--dir", help="working directory for clips and outputs (default: the data directory)")
+    parser.add_argument("--target-size", type=float, default=255, metavar="KB")
+    parser.add_argument("--accuracy", type=float, default=5, metavar="KB")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per clip")
+    parser.add_argument("--set", type=_option, action="append", default=[], metavar="KEY=VALUE",
+                        help="convert_optimize option, e.g. --set strategy=bisect --set mezzanine=None")
+    args = parser.parse_args(argv)
+    report = run_benchmark(args.clips, args.dir, args.target_size, args.accuracy, args.repeat, **dict(args.set))
+    print(format_report(report), flush=True)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            print(compare(report, json.load(f)), flush=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
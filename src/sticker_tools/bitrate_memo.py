@@ -0,0 +1,133 @@
+import logging
+import os
+import time
+from typing import List, Optional
+
+from .probe import MediaInfo
+from .profiles import get_profile
+from .rate_control import Sample, model_strategy
+from .storage import file_digest, load_json, save_json
+
+logging.basicConfig(level=logging.INFO)
+
+MEMO_FILE = "bitrate_memo.json"
+MAX_SAMPLES_PER_CLIP = 32
+MAX_CLIPS = 2000
+# a clip of the same name and geometry counts as a re-trim of a stored one if
+# it's at most this many times shorter or longer
+MAX_TRIM_RATIO = 2.0
+
+
+class BitrateMemo:
+    """
+    Remembers every (bitrate -> size) sample measured for a clip, so a later
+    conversion of the same or a re-trimmed clip can start from the stored
+    curve instead of the naive `estimate_bitrate` guess.
+
+    Samples are stored as bitrate and KB per second of video, which makes
+    them usable for a different duration of the same footage. A clip is
+    found by its content hash; failing that, the latest entry with the same
+    file name, frame size and frame rate whose duration is within
+    `MAX_TRIM_RATIO` of the clip's is used (a re-exported or re-trimmed
+    version of the clip). The encoder settings change the curve, so every
+    profile and intermediate keeps entries of its own.
+
+    The index is a single JSON document in the data directory. Concurrent
+    writers may drop each other's samples, which only costs a colder start.
+
+    :param name: file of the index in the data directory
+    :param profile: encoder profile of the conversions (see `profiles`)
+    :param mezzanine: intermediate of the conversions, None if they read the source
+    """
+
+    def __init__(self, name: str = MEMO_FILE, profile=None, mezzanine: str = "ffv1"):
+        self.name = name
+        self.variant = f"{get_profile(profile).name}/{mezzanine or 'source'}"
+
+    def _load(self) -> dict:
+        return load_json(self.name, {})
+
+    def _key(self, digest: str) -> str:
+        return f"{digest}:{self.variant}"
+
+    def _is_trim(self, entry: dict, name: str, info: MediaInfo) -> bool:
+        if entry.get("variant") != self.variant or entry.get("name") != name:
+            return False
+        if (entry.get("width"), entry.get("height")) != (info.width, info.height):
+            return False
+        if not entry.get("fps") or not info.fps or abs(entry["fps"] - info.fps) > 0.01 * info.fps:
+            return False
+        duration = entry.get("duration") or 0
+        return duration > 0 and info.duration > 0 and \
+            max(duration, info.duration) / min(duration, info.duration) <= MAX_TRIM_RATIO
+
+    def lookup(self, input_path: str, info: MediaInfo, digest: str = None) -> Optional[dict]:
+        """
+        Finds the stored entry of the clip or of a re-trimmed version of it.
+
+        :param info: MediaInfo of the clip
+        :return: the entry ({"name", "variant", "duration", "width", "height", "fps", "samples",
+            "updated"}) or None
+        """
+        clips = self._load()
+        digest = digest or file_digest(input_path)
+        key = self._key(digest)
+        if key in clips:
+            return clips[key]
+        name = os.path.basename(os.path.splitext(input_path)[0])
+        similar = [entry for entry in clips.values() if self._is_trim(entry, name, info)]
+        if similar:
+            return max(similar, key=lambda entry: entry.get("updated", 0))
+        return None
+
+    def samples_for(self, input_path: str, info: MediaInfo, digest: str = None) -> List[Sample]:
+        """
+        Stored samples of the clip, rescaled to its duration.
+        """
+        entry = self.lookup(input_path, info, digest)
+        if not entry:
+            return []
+        return [Sample(bitrate, kb_per_second * info.duration) for bitrate, kb_per_second in entry["samples"]]
+
+    def record(self, input_path: str, info: MediaInfo, samples: List[Sample], digest: str = None) -> None:
+        """
+        Adds measured samples to the clip's entry. Extrapolated samples of
+        aborted encodes are left out.
+        """
+        clips = self._load()
+        digest = digest or file_digest(input_path)
+        entry = clips.setdefault(self._key(digest), {"samples": []})
+        entry["name"] = os.path.basename(os.path.splitext(input_path)[0])
+        entry["variant"] = self.variant
+        entry.update(duration=info.duration, width=info.width, height=info.height, fps=info.fps)
+        entry["updated"] = time.time()
+        measured = [[s.bitrate, s.size_kb / info.duration] for s in samples if not s.partial]
+        entry["samples"] = (entry["samples"] + measured)[-MAX_SAMPLES_PER_CLIP:]
+        if len(clips) > MAX_CLIPS:
+            oldest = sorted(clips, key=lambda key: clips[key].get("updated", 0))[:len(clips) - MAX_CLIPS]
+            for key in oldest:
+                del clips[key]
+        save_json(self.name, clips)
+
+
+def warm_start(samples: List[Sample], target_size_kb: float, accuracy_kb: float) -> Optional[float]:
+    """
+    Seed bitrate predicted from previously measured samples: an exact
+    under-target hit is reused as is, otherwise the size model of
+    `rate_control.model_strategy` is solved for the target.
+
+    :return: bitrate in bps, or None without samples
+    """
+    logger = logging.getLogger("bitrate_memo")
+    if not samples:
+        return None
+    hits = [s for s in samples if target_size_kb - accuracy_kb < s.size_kb < target_size_kb]
+    if hits:
+        seed = max(hits, key=lambda s: s.size_kb).bitrate
+    else:
+        seed = model_strategy(samples, target_size_kb, accuracy_kb)
+        if seed is None:
+            # saturated curve: the largest under-target bitrate is as good as any higher one
+            seed = max(s.bitrate for s in samples if s.size_kb < target_size_kb)
+    logger.info(f"Warm start from {len(samples)} stored samples: {seed / 1000:.2f} kbps")
+    return seed
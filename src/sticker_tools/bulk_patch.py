@@ -0,0 +1,127 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from typing import Iterable, List
+
+from .patch_duration import _read_duration_field, _write_duration_field
+
+logging.basicConfig(level=logging.INFO)
+
+# durations closer than this to the requested one count as already patched
+TOLERANCE_SECONDS = 1e-3
+
+
+@dataclass(slots=True)
+class PatchResult:
+    """
+    Outcome of patching one file.
+
+    :param filename: the .webm file
+    :param status: "patched", "skipped" (already patched), "would patch" (dry run),
+        "ok"/"unpatched" (verify mode) or "error"
+    :param before: duration found in the file, seconds
+    :param after: duration in the file afterwards, seconds
+    :param error: error message if the file couldn't be read or patched
+    """
+    filename: str
+    status: str
+    before: float = None
+    after: float = None
+    error: str = None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def find_webm(paths: Iterable[str], recursive: bool = True) -> List[str]:
+    """
+    Collects .webm files from files and directories.
+
+    :param paths: .webm files or directories to search
+    :param recursive: descend into subdirectories
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in sorted(names) if name.lower().endswith(".webm"))
+                if not recursive:
+                    break
+                dirs.sort()
+        elif os.path.exists(path):
+            files.append(path)
+        else:
+            raise FileNotFoundError(f"Input file not found: {path}")
+    return list(dict.fromkeys(files))
+
+
+def patch_one(filename: str, new_seconds: float = 1, dry_run: bool = False, verify: bool = False) -> PatchResult:
+    """
+    Patches the duration of one file unless it already has the requested value.
+    Errors are reported in the result instead of being raised.
+
+    :param dry_run: only report what would be patched
+    :param verify: only check whether the file is patched
+    """
+    try:
+        with open(filename, "rb" if dry_run or verify else "r+b") as f:
+            start_idx, payload_size, before = _read_duration_field(f)
+            done = abs(before - new_seconds) < TOLERANCE_SECONDS
+            if verify:
+                return PatchResult(filename, "ok" if done else "unpatched", before, before)
+            if done:
+                return PatchResult(filename, "skipped", before, before)
+            if dry_run:
+                return PatchResult(filename, "would patch", before, new_seconds)
+            _write_duration_field(f, start_idx, payload_size, new_seconds)
+            f.flush()
+            after = _read_duration_field(f)[2]
+    except (OSError, ValueError, RuntimeError, EOFError) as e:
+        return PatchResult(filename, "error", error=str(e))
+    return PatchResult(filename, "patched", before, after)
+
+
+def patch_many(filenames: Iterable[str], new_seconds: float = 1, workers: int = 8,
+               dry_run: bool = False, verify: bool = False) -> List[PatchResult]:
+    """
+    Patches many files concurrently. Header patching is I/O bound, so a
+    thread pool is used. Results come back in the order of `filenames`.
+
+    :param filenames: .webm files
+    :param new_seconds: new duration in seconds
+    :param workers: number of threads
+    :param dry_run: only report what would be patched
+    :param verify: only check whether the files are patched
+    """
+    logger = logging.getLogger("patch_duration")
+    filenames = list(filenames)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(lambda name: patch_one(name, new_seconds, dry_run, verify), filenames))
+    logger.info(f"Processed {_totals(results)}")
+    return results
+
+
+def _totals(results: List[PatchResult]) -> str:
+    counts = {}
+    for result in results:
+        counts[result.status] = counts.get(result.status, 0) + 1
+    return f"{len(results)} files: " + ", ".join(f"{n} {status}" for status, n in sorted(counts.items()))
+
+
+def format_table(results: List[PatchResult]) -> str:
+    """
+    Summary table of a bulk run: one row per file and totals per status.
+    """
+    def seconds(value):
+        return "-" if value is None else f"{value:.3f}"
+
+    width = max([len("file")] + [len(r.filename) for r in results])
+    lines = [f"{'file':<{width}}  {'before':>9}  {'after':>9}  status",
+             "-" * (width + 32)]
+    for r in results:
+        status = r.status if not r.error else f"{r.status}: {r.error}"
+        lines.append(f"{r.filename:<{width}}  {seconds(r.before):>9}  {seconds(r.after):>9}  {status}")
+    lines.append("-" * (width + 32))
+    lines.append(_totals(results))
+    return "\n".join(lines)
@@ -0,0 +1,122 @@
+import logging
+import os
+from dataclasses import dataclass
+
+from .convert_optimize import vp9_pass1, vp9_pass2, get_scalecrop_filter
+from .probe import MediaInfo
+from .profiles import get_profile
+from .rate_control import search
+from .storage import load_json, save_json
+
+logging.basicConfig(level=logging.INFO)
+
+RATIOS_FILE = "proxy_ratios.json"
+# weight of the newest observation in the stored proxy-to-final ratio
+RATIO_SMOOTHING = 0.3
+
+
+@dataclass(slots=True)
+class Calibration:
+    """
+    Result of the proxy calibration stage.
+
+    :param proxy_bitrate: bitrate at which the proxy encode lands on the target size, bps
+    :param ratio: stored final-to-proxy bitrate ratio used for the prediction
+    :param seed_bitrate: predicted bitrate of the final encode, bps
+    :param encodes: number of proxy encodes used
+    :param key: identifies the proxy and final encode settings the ratio belongs to
+    """
+    proxy_bitrate: float
+    ratio: float
+    seed_bitrate: float
+    encodes: int
+    key: str
+
+
+def proxy_filter(input_path, size: int = 256, frame_step: int = 1) -> str:
+    """
+    Filter chain of the proxy encode: the regular scale/crop, then a downscale
+    to `size` x `size` and, with frame_step > 1, keeping only every n-th frame.
+    Timestamps are kept, so the proxy has the same duration as the final encode.
+
+    :param input_path: file path or its MediaInfo
+    """
+    filters = []
+    scalecrop = get_scalecrop_filter(input_path)
+    if scalecrop:
+        filters.append(scalecrop)
+    filters.append(f"scale={size}:{size}")
+    if frame_step > 1:
+        filters.append(f"select=not(mod(n\\,{frame_step}))")
+    return ",".join(filters)
+
+
+def _ratio_key(size: int, frame_step: int, speed: int, profile=None, mezzanine: str = "ffv1") -> str:
+    # the final encodes' settings change the ratio as much as the proxy's
+    return f"{get_profile(profile).name}/{mezzanine or 'source'}/{size}px/{frame_step}f/speed{speed}"
+
+
+def calibrate(input_path: str, seed_bitrate: float, target_size_kb: float = 255, accuracy_kb: float = 5,
+              size: int = 256, frame_step: int = 2, speed: int = 8, max_encodes: int = 4,
+              scratch_dir: str = None, info: MediaInfo = None, profile=None,
+              mezzanine: str = "ffv1") -> Calibration:
+    """
+    Runs a quick bitrate search on a low resolution, realtime quality proxy of
+    the clip and converts the found proxy bitrate into a seed for the slow
+    final-quality search using the stored proxy-to-final ratio.
+
+    :param input_path: source video
+    :param seed_bitrate: first guess for the proxy search, bps
+    :param size: side of the square proxy in pixels
+    :param frame_step: keep every n-th frame of the proxy
+    :param speed: libvpx `-speed` of the proxy encodes
+    :param max_encodes: limit of the proxy encodes
+    :param scratch_dir: directory for the proxy files, next to the input by default
+    :param info: MediaInfo of the input if it's already probed
+    :param profile: encoder profile of the final encodes (see `profiles`)
+    :param mezzanine: intermediate the final encodes read, None if they read the source
+    :return: Calibration
+    """
+    logger = logging.getLogger("calibration")
+    base = os.path.splitext(input_path)[0]
+    if scratch_dir:
+        base = os.path.join(scratch_dir, os.path.basename(base))
+    proxy_path = base + ".proxy.webm"
+    passlog = base + ".proxy"
+    options = dict(speed=speed, quality='realtime', filters=proxy_filter(info or input_path, size, frame_step))
+
+    def encode(vid_bps):
+        vp9_pass2(input_path, proxy_path, vid_bps, passlogfile=passlog, **options)
+        return os.path.getsize(proxy_path) / 1024
+
+    logger.info(f"Calibrating on a {size}x{size} proxy, every {frame_step} frame(s), speed {speed}")
+    try:
+        vp9_pass1(input_path, proxy_path, seed_bitrate, passlogfile=passlog, **options)
+        result = search(encode, seed_bitrate, target_size_kb, accuracy_kb, max_encodes=max_encodes)
+    finally:
+        for path in (proxy_path, passlog + "-0.log"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    key = _ratio_key(size, frame_step, speed, profile, mezzanine)
+    ratio = load_json(RATIOS_FILE, {}).get(key, 1.0)
+    seed = result.bitrate * ratio
+    logger.info(f"Proxy bitrate {result.bitrate / 1000:.2f} kbps x ratio {ratio:.3f} -> seed {seed / 1000:.2f} kbps")
+    return Calibration(result.bitrate, ratio, seed, result.encodes, key)
+
+
+def update_ratio(calibration: Calibration, final_bitrate: float) -> float:
+    """
+    Folds the bitrate the final search settled on into the stored proxy-to-final ratio.
+
+    :return: the updated ratio
+    """
+    ratios = load_json(RATIOS_FILE, {})
+    observed = final_bitrate / calibration.proxy_bitrate
+    previous = ratios.get(calibration.key)
+    ratio = observed if previous is None else (1 - RATIO_SMOOTHING) * previous + RATIO_SMOOTHING * observed
+    ratios[calibration.key] = ratio
+    save_json(RATIOS_FILE, ratios)
+    return ratio
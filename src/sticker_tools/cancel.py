@@ -0,0 +1,126 @@
+import subprocess
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_current = ContextVar("sticker_tools_cancel", default=None)
+
+# reasons after which a job keeps its best result so far; any other one (e.g.
+# "lost": the spool gave the job to another worker) leaves no output behind
+KEEP_BEST = ("cancelled", "timeout")
+
+
+class Cancelled(Exception):
+    """
+    Raised inside a job whose CancelToken was cancelled or ran out of time.
+
+    :param reason: "cancelled", "timeout" or "lost" (see `spool`)
+    """
+
+    def __init__(self, reason: str = "cancelled", message: str = None):
+        super().__init__(message or f"The job was {reason}")
+        self.reason = reason
+
+    def __reduce__(self):
+        # keep the reason when the error crosses a process boundary (batch workers)
+        return type(self), (self.reason, str(self))
+
+
+class CancelToken:
+    """
+    Stops one job from another thread: `cancel` kills the ffmpeg/ffprobe
+    processes the job is running and makes it raise Cancelled before it
+    starts another one. With `timeout` the token cancels itself once the job
+    has run that many seconds (counted from `start`).
+
+    Processes started through `process.run`, `process.popen` and
+    `progress.run_with_progress` inside `scope(token)` are tracked.
+
+    :param timeout: time budget of the job in seconds, None for no limit
+    """
+
+    def __init__(self, timeout: float = None):
+        self.timeout = timeout
+        self.reason = None
+        self._processes = set()
+        self._lock = threading.Lock()
+        self._timer = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def start(self) -> None:
+        """
+        Starts counting the time budget, if any.
+        """
+        if self.timeout is not None and self._timer is None:
+            self._timer = threading.Timer(self.timeout, self.cancel, args=("timeout",))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def stop(self) -> None:
+        """
+        Stops the timer, e.g. once the job is done.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        """
+        Cancels the job and kills its running child processes.
+        """
+        with self._lock:
+            if self.reason is None:
+                self.reason = reason
+            processes = list(self._processes)
+        for process in processes:
+            try:
+                process.kill()
+            except OSError:
+                pass
+
+    def error(self) -> Cancelled:
+        if self.reason == "timeout":
+            return Cancelled("timeout", f"The job ran out of its {self.timeout:g} s time budget")
+        return Cancelled(self.reason)
+
+    def check(self) -> None:
+        """
+        Raises Cancelled if the job was cancelled.
+        """
+        if self.cancelled:
+            raise self.error()
+
+    def attach(self, process: subprocess.Popen) -> None:
+        with self._lock:
+            self._processes.add(process)
+            cancelled = self.cancelled
+        if cancelled:
+            process.kill()
+
+    def detach(self, process: subprocess.Popen) -> None:
+        with self._lock:
+            self._processes.discard(process)
+
+
+def current() -> CancelToken:
+    """
+    CancelToken of the running job, None outside `scope`.
+    """
+    return _current.get()
+
+
+@contextmanager
+def scope(token: CancelToken):
+    """
+    Makes `token` the cancel token of the code in the block (and of threads
+    started with a copy of its context) and starts its time budget.
+    """
+    reset = _current.set(token)
+    token.start()
+    try:
+        yield token
+    finally:
+        token.stop()
+        _current.reset(reset)
@@ -1,23 +1,220 @@
-from .convert_optimize import convert_optimize
-from .patch_duration import patch_duration
-import os
-
-def create_sticker():
-    import sys
-    # ensure at least one argument is provided
-    if len(sys.argv) < 2:
-        raise ValueError("No input file path provided. Usage: sticker <input_path>")
-    input_path = sys.argv[1]
-    # ensure the provided argument is a valid path
-    if not os.path.exists(input_path):
-        raise FileNotFoundError(f"Input file not found: {input_path}")
-    # determine extension
-    ext = os.path.splitext(input_path)[1].lower()
-    if ext == ".webm":
-        # input is already WebM: only patch duration
-        patch_duration(input_path)
+from .batch import expand_inputs, run_batch
+from .bulk_patch import find_webm, patch_many, format_table
+from .pipeline import make_sticker
+from .profiles import PROFILES, TUNED
+from .progress import ProgressPrinter
+from .result_cache import ResultCache, DEFAULT_MAX_BYTES
+from .scratch import SINKS
+from .trace import TRACE_FORMATS, write_trace
+from .variants import EMOJI, Target, make_variants
+from .webm_inspect import inspect_many, format_table as format_inspection
+import json
+import argparse
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="sticker",
+        description="Convert videos into Telegram video stickers and patch their duration.",
+    )
+    parser.add_argument("paths", nargs="*", help="files, glob patterns or directories to process")
+    parser.add_argument("-j", "--jobs", type=int, default=0,
+                        help="parallel conversions (default: cores / threads)")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="ffmpeg encoder threads per conversion (default: automatic)")
+    parser.add_argument("--target-size", type=float, default=255, metavar="KB",
+                        help="upper limit of the sticker size in KB (default: 255)")
+    parser.add_argument("--accuracy", type=float, default=5, metavar="KB",
+                        help="stop the search once this close under the target (default: 5)")
+    parser.add_argument("--calibrate", action="store_true",
+                        help="seed the bitrate search with fast proxy encodes")
+    parser.add_argument("--emoji", action="store_true",
+                        help="also produce a 100x100, 64 KB custom emoji (<name>_emoji.webm) from the same decode")
+    parser.add_argument("--profile", choices=list(PROFILES) + [TUNED],
+                        help="encoder settings: draft (fastest), balanced or archival (default), or the tuned "
+                             "profile picked by sticker-tune on this machine")
+    parser.add_argument("--segments", type=int, default=0, metavar="N",
+                        help="encode long clips as N chunks in parallel (default: off)")
+    parser.add_argument("--timeout", type=float, metavar="SECONDS",
+                        help="time budget per file; when it runs out the best encode so far is kept (default: none)")
+    parser.add_argument("--journal", metavar="FILE",
+                        help="record job states in FILE; rerunning with the same FILE skips finished files "
+                             "and resumes interrupted ones")
+    parser.add_argument("--sink", choices=SINKS, default="ram",
+                        help="where trial encodes are written: RAM-backed scratch (on disk when it's too full) "
+                             "or next to the output (default: ram)")
+    parser.add_argument("--json", action="store_true",
+                        help="print one JSON line per processed file")
+    parser.add_argument("--progress", choices=("none", "line", "json"), default="none",
+                        help="show ffmpeg progress on stderr as a status line or JSON lines (default: none)")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="write wall time, CPU time and peak RSS of every stage of every job to FILE")
+    parser.add_argument("--trace-format", choices=TRACE_FORMATS, default="json",
+                        help="json records or chrome trace events for chrome://tracing / Perfetto (default: json)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="don't look up or store finished stickers in the result cache")
+    parser.add_argument("--cache-size", type=float, default=DEFAULT_MAX_BYTES / 1024 / 1024, metavar="MB",
+                        help="size limit of the result cache (default: %(default)d MB)")
+    parser.add_argument("--prune-cache", action="store_true",
+                        help="evict cached stickers over --cache-size (use --cache-size 0 to empty the cache)")
+    queue = parser.add_argument_group("shared work queue (a spool directory several machines can drain)")
+    queue.add_argument("--submit", metavar="SPOOL",
+                       help="queue the files with the given conversion options instead of converting them")
+    queue.add_argument("--worker", metavar="SPOOL",
+                       help="run as a worker converting the jobs queued in SPOOL")
+    queue.add_argument("--once", action="store_true",
+                       help="with --worker, exit once the queue is drained instead of waiting for new jobs")
+    patching = parser.add_argument_group("bulk patching of existing .webm files")
+    patching.add_argument("--patch-only", action="store_true",
+                          help="only patch the duration of .webm files (directories are searched recursively)")
+    patching.add_argument("--duration", type=float, default=1, metavar="SECONDS",
+                          help="duration to write into the files (default: 1)")
+    patching.add_argument("--dry-run", action="store_true",
+                          help="show which files would be patched without changing them")
+    patching.add_argument("--verify", action="store_true",
+                          help="only check that the files are patched")
+    patching.add_argument("--inspect", action="store_true",
+                          help="check codec, frame size, fps, frame count, size and duration of the files "
+                               "against Telegram's sticker limits, reading the WebM headers without ffprobe")
+    return parser
+
+
+def _patch_only(args):
+    results = patch_many(find_webm(args.paths), args.duration, workers=args.jobs or 8,
+                         dry_run=args.dry_run, verify=args.verify)
+    if args.json:
+        for result in results:
+            print(json.dumps(result.to_dict()), flush=True)
     else:
-        # convert other formats to WebM, then patch
-        output_path = os.path.splitext(input_path)[0] + ".webm"
-        convert_optimize(input_path)
-        patch_duration(output_path)
\ No newline at end of file
+        print(format_table(results), flush=True)
+    bad = sum(result.status in ("error", "unpatched") for result in results)
+    if bad:
+        raise SystemExit(f"{bad} of {len(results)} files failed the check")
+
+
+def _inspect(args):
+    reports = inspect_many(find_webm(args.paths), workers=args.jobs or 8)
+    if args.json:
+        for report in reports:
+            print(json.dumps(report.to_dict()), flush=True)
+    else:
+        print(format_inspection(reports), flush=True)
+    bad = sum(report.status != "ok" for report in reports)
+    if bad:
+        raise SystemExit(f"{bad} of {len(reports)} files failed the check")
+
+
+def _print_result(result, as_json: bool):
+    if as_json:
+        data = result.to_dict()
+        data.pop("trace")
+        print(json.dumps(data), flush=True)
+    elif result.size_kb is None:
+        # failed, or stopped before any encode fit under the target
+        print(f"{result.input_path}: {result.status}: {result.error}", flush=True)
+    elif result.status in ("success", "cancelled", "timeout", "over_target"):
+        bitrate = f"{result.bitrate / 1000:.2f} kbps" if result.bitrate else "-"
+        cached = " (cached)" if result.cached else " (resumed)" if result.resumed else ""
+        stopped = f" ({result.status}: {result.error})" if result.status != "success" else ""
+        print(f"{result.output_path}: {result.size_kb:.2f} kb, {bitrate}, "
+              f"{result.encodes} encodes, {result.seconds:.1f} s{cached}{stopped}", flush=True)
+    else:
+        print(f"{result.input_path}: error: {result.error}", flush=True)
+
+
+def _result_cache(args):
+    # created only for runs that convert, so e.g. --inspect doesn't touch the data directory
+    return None if args.no_cache else ResultCache(max_bytes=int(args.cache_size * 1024 * 1024))
+
+
+def _worker(args):
+    from .spool import run_worker
+    options = dict(threads=args.threads, sink=args.sink, cache=_result_cache(args), trace=bool(args.trace))
+    if args.progress != "none":
+        options["event_callback"] = ProgressPrinter(args.progress)
+    records = []
+    try:
+        for result in run_worker(args.worker, once=args.once, **options):
+            records += result.trace or []
+            _print_result(result, args.json)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.trace:
+            write_trace(args.trace, records, args.trace_format)
+
+
+def create_sticker(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.prune_cache:
+        removed = ResultCache(max_bytes=int(args.cache_size * 1024 * 1024)).prune()
+        print(f"Removed {removed} cached stickers", flush=True)
+        if not args.paths:
+            return
+    if args.worker:
+        _worker(args)
+        return
+    if not args.paths:
+        parser.error("No input file path provided. Usage: sticker <input_path>")
+    if args.inspect:
+        _inspect(args)
+        return
+    if args.patch_only or args.dry_run or args.verify:
+        _patch_only(args)
+        return
+    files = expand_inputs(args.paths)
+    if args.emoji:
+        if args.calibrate or args.segments or args.journal:
+            parser.error("--calibrate, --segments and --journal can't be combined with --emoji")
+        sticker = Target("sticker", target_size_kb=args.target_size, accuracy_kb=args.accuracy)
+        options = dict(targets=(sticker, EMOJI), sink=args.sink, trace=bool(args.trace), timeout=args.timeout)
+    else:
+        options = dict(target_size_kb=args.target_size, accuracy_kb=args.accuracy, calibrate=args.calibrate,
+                       sink=args.sink, segments=args.segments, trace=bool(args.trace), timeout=args.timeout)
+    if args.profile:
+        # only when given, so the result cache keys of default conversions stay the same
+        options["profile"] = args.profile
+
+    if args.submit:
+        if args.emoji or args.journal:
+            parser.error("--emoji and --journal can't be combined with --submit")
+        from .spool import submit
+        job_options = {k: v for k, v in options.items() if k not in ("trace", "sink")}
+        for path in files:
+            print(f"{path}: queued as {submit(args.submit, path, **job_options)}", flush=True)
+        return
+    if not args.emoji:
+        options["cache"] = _result_cache(args)
+
+    progress = None if args.progress == "none" else args.progress
+
+    if len(files) == 1 and not args.journal:
+        # a single file is processed in this process, errors propagate as before
+        if progress:
+            options["event_callback"] = ProgressPrinter(progress, label=files[0])
+        if args.emoji:
+            results = make_variants(files[0], threads=args.threads, **options)
+        else:
+            results = [make_sticker(files[0], threads=args.threads, **options)]
+        for result in results:
+            _print_result(result, args.json)
+        if args.trace:
+            write_trace(args.trace, results[0].trace, args.trace_format)
+        failed = sum(result.size_kb is None or result.status == "over_target" for result in results)
+        if failed:
+            raise SystemExit(f"{failed} of {len(results)} outputs failed")
+        return
+
+    failed = 0
+    records = []
+    for result in run_batch(files, jobs=args.jobs, threads=args.threads, progress=progress,
+                            journal=args.journal, **options):
+        # a stopped job that kept its best encode still produced a sticker, an oversized one didn't
+        failed += result.size_kb is None or result.status == "over_target"
+        records += result.trace or []
+        _print_result(result, args.json)
+    if args.trace:
+        write_trace(args.trace, records, args.trace_format)
+    if failed:
+        raise SystemExit(f"{failed} outputs of {len(files)} files failed")
@@ -1,35 +1,20 @@
 import logging
 
-import sys
-import platform
 import os
-from pathlib import Path
-import subprocess
-
-def run(cmd, **kwargs):
-    # on Windows add the no-window flags …
-    if sys.platform == "win32":
-        kwargs.setdefault("creationflags", subprocess.CREATE_NO_WINDOW)
-        si = subprocess.STARTUPINFO()
-        si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        si.wShowWindow = subprocess.SW_HIDE
-        kwargs.setdefault("startupinfo", si)
-
-    # only set check once
-    kwargs.setdefault("check", True)
-
-    # **don’t** do: kwargs.setdefault("stdout", PIPE) or stderr here
-    return subprocess.run(cmd, **kwargs)
-
-
-if platform.system() == 'Windows':
-    if getattr(sys, 'frozen', False):
-        base = Path(sys._MEIPASS)
-    else:
-        # when running from source, project root is two levels up
-        base = Path(__file__).resolve().parents[2]
-    bin_dir = base / 'bin'
-    os.environ['PATH'] = str(bin_dir) + os.pathsep + os.environ.get('PATH', '')
+import functools
+import time
+from typing import List, Tuple
+
+from .cancel import Cancelled, KEEP_BEST
+from .process import run
+from .probe import probe, MediaInfo
+from .profiles import get_profile
+from .progress import run_with_progress, reporter
+from .rate_control import search, SearchResult, Overshoot, Sample, fallback_bitrate
+from .scratch import job_scratch, promote, scratch_root
+from .storage import file_digest
+from . import trace
+from .bitrate_memo import BitrateMemo, warm_start
 
 logging.basicConfig(level=logging.INFO)
 
@@ -45,36 +30,44 @@ logging.basicConfig(level=logging.INFO)
 #   -pass 2 -an \
 #   output.webm
 
+@functools.lru_cache(maxsize=None)
+def ffmpeg_version() -> str:
+    """
+    First line of `ffmpeg -version`, cached for the lifetime of the process.
+    """
+    result = run(['ffmpeg', '-version'], capture_output=True, text=True)
+    return result.stdout.splitlines()[0] if result.stdout else ""
+
+
+def _media_info(source) -> MediaInfo:
+    return source if isinstance(source, MediaInfo) else probe(source)
+
+
 def get_duration(path):
-    import json
-    import shlex
-    cmd = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'json', path]
-    result = run(cmd, capture_output=True, text=True, check=True)
-    info = json.loads(result.stdout)
-    return float(info["format"]["duration"])
+    """
+    Duration in seconds of a file path or an already probed MediaInfo.
+    """
+    return _media_info(path).duration
 
 def estimate_bitrate(duration: float, target_size_kb: float) -> float:
     return target_size_kb * 1024 * 8 / duration
 
 def get_scalecrop_filter(path):
-    import json
-    import shlex
-    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=width,height,avg_frame_rate', '-of', 'json', path]
-    result = run(cmd, capture_output=True, text=True, check=True)
-    info = json.loads(result.stdout)["streams"][0]
-    w = int(info["width"])
-    h = int(info["height"])
-    # skip unnecessary resampling if already at target resolution
-    if w == 512 and h == 512:
-        return None
-    fr = info.get("avg_frame_rate", "0/1")
-    num, den = map(int, fr.split('/'))
-    fps = num / den if den else 0
+    """
+    Filter chain bringing a file path or an already probed MediaInfo to 512x512.
+    """
+    info = _media_info(path)
+    w = info.width
+    h = info.height
+    fps = info.fps
 
     filters = []
 
+    # skip unnecessary resampling if already at target resolution
+    if w == 512 and h == 512:
+        pass
     # scale the smallest dimension to 512, then center-crop the larger to 512
-    if w < h:
+    elif w < h:
         # scale width to 512, maintain aspect, then crop height
         filters.append("scale=512:-1,crop=512:512:0:(ih-512)/2")
     else:
@@ -89,49 +82,219 @@ def get_scalecrop_filter(path):
         return None
     return ",".join(filters)
 
-def vp9_pass1(input_path: str, output_path: str, vid_bps: float):
+def output_frames(info: MediaInfo) -> int:
     """
-    First pass: analyze video complexity for two-pass VP9 encoding.
+    Number of frames the encode of a probed source has: the scale/crop chain
+    caps the frame rate at 30 fps (see `get_scalecrop_filter`).
     """
-    vf = get_scalecrop_filter(input_path)
+    fps = min(info.fps, 30) if info.fps else 30
+    return round(info.duration * fps)
+
+
+def vp9_command(pass_no: int, input_path: str, output_path: str, vid_bps: float, passlogfile: str = None,
+                speed: str = '0', quality: str = 'best', filters: str = None, threads: int = 0,
+                profile=None):
+    """
+    Builds the ffmpeg command line of one VP9 pass.
+
+    :param pass_no: 1 for the analysis pass, 2 for the actual encode
+    :param passlogfile: prefix of the first pass statistics file (defaults to `output_path`)
+    :param speed: libvpx `-speed`
+    :param quality: libvpx `-quality` (deadline): best, good or realtime
+    :param filters: optional filter chain passed as `-vf`
+    :param threads: encoder threads, 0 lets ffmpeg pick (one per core, up to 16)
+    :param profile: `profiles.EncoderProfile` or its name; its speed and quality replace `speed` and
+        `quality` and its other settings (tiles, lag, alt-ref, ...) are added
+    """
+    extra = []
+    if profile is not None:
+        profile = get_profile(profile)
+        speed, quality, extra = profile.pass_speed(pass_no), profile.quality, profile.encoder_args()
     cmd = [
         'ffmpeg', '-strict', '-2', '-v', 'quiet', '-hide_banner', '-threads', '0', '-hwaccel', 'auto',
         '-i', input_path,
-        '-pass', '1', '-passlogfile', output_path,
+        '-pass', str(pass_no), '-passlogfile', passlogfile or output_path,
         '-c:v', 'libvpx-vp9', '-row-mt', '1',
         '-b:v', str(vid_bps),
-        '-speed', '0', '-quality', 'best',
+        '-speed', str(speed), '-quality', quality, *extra,
         '-map', 'v:0', '-an', '-pix_fmt', 'yuv420p',
         '-timecode', '01:00:00:00',
         '-sws_flags', 'bicubic',
-        '-y', output_path
     ]
-    run(cmd)
+    if filters:
+        cmd += ['-vf', filters]
+    if threads:
+        cmd += ['-threads', str(threads)]
+    cmd += ['-y', output_path]
+    return cmd
+
+
+def vp9_pass1(input_path: str, output_path: str, vid_bps: float, passlogfile: str = None, on_progress=None,
+              **options):
+    """
+    First pass: analyze video complexity for two-pass VP9 encoding.
+    The statistics are written to `passlogfile` (defaults to `output_path`).
+    Extra `options` (speed, quality, filters, threads, profile) are passed to `vp9_command`.
+    `on_progress` receives ffmpeg's progress blocks (see `progress.run_with_progress`).
+    """
+    cmd = vp9_command(1, input_path, output_path, vid_bps, passlogfile, **options)
+    with trace.span("pass1", input=input_path, bitrate=vid_bps):
+        if on_progress is None:
+            run(cmd)
+        else:
+            run_with_progress(cmd, on_progress)
 
 
-def vp9_pass2(input_path: str, output_path: str, vid_bps: float):
+def vp9_pass2(input_path: str, output_path: str, vid_bps: float, passlogfile: str = None, on_progress=None,
+              **options) -> bool:
     """
     Second pass: encode video using two-pass VP9 with file-size guard.
+    Reads the first pass statistics from `passlogfile` (defaults to `output_path`).
+    Extra `options` (speed, quality, filters, threads, profile) are passed to `vp9_command`.
+
+    With `on_progress` the encode is monitored through ffmpeg's `-progress`
+    output and stopped if the callback returns True (see `progress.run_with_progress`).
+
+    :return: True if the encode ran to completion
     """
-    vf = get_scalecrop_filter(input_path)
+    cmd = vp9_command(2, input_path, output_path, vid_bps, passlogfile, **options)
+    with trace.span("pass2", input=input_path, bitrate=vid_bps) as args:
+        if on_progress is None:
+            run(cmd)
+            return True
+        args["completed"] = run_with_progress(cmd, on_progress)
+        return args["completed"]
+
+
+class OvershootGuard:
+    """
+    Progress callback for `vp9_pass2` that stops a trial encode once it
+    clearly ends over the target size: either the bytes already written
+    exceed it, or, after `min_fraction` of the frames, the size extrapolated
+    to all frames exceeds it by `margin`. An extrapolation can be wrong for
+    a clip whose hard part comes first, so the search treats the aborted
+    encode as a soft upper bound (see `rate_control._bracket`).
+
+    :param target_size_kb: size limit
+    :param total_frames: number of frames of the encoded stream
+    """
+
+    def __init__(self, target_size_kb: float, total_frames: int, min_fraction: float = 0.25, margin: float = 1.1):
+        self.target_size_kb = target_size_kb
+        self.total_frames = total_frames
+        self.min_fraction = min_fraction
+        self.margin = margin
+        self.projected_kb = None
+
+    def __call__(self, block) -> bool:
+        try:
+            frame = int(block.get("frame", 0))
+            written_kb = int(block.get("total_size", 0)) / 1024
+        except ValueError:
+            return False
+        if written_kb > self.target_size_kb:
+            self.projected_kb = max(written_kb, written_kb * self.total_frames / frame) if frame else written_kb
+            return True
+        if not frame or not self.total_frames or frame < self.min_fraction * self.total_frames:
+            return False
+        projected_kb = written_kb * self.total_frames / frame
+        if projected_kb > self.target_size_kb * self.margin:
+            self.projected_kb = projected_kb
+            return True
+        return False
+
+
+def prepare_mezzanine(input_path: str, directory: str, info: MediaInfo = None, codec: str = "ffv1",
+                      on_progress=None):
+    """
+    Decodes the source once, applies the 512x512 scale/crop and the 30 fps cap
+    and writes a fast-to-read intermediate that every encode pass reads
+    instead of decoding and rescaling the original again.
+
+    :param input_path: source video
+    :param directory: where to write the intermediate (a scratch dir, ideally on tmpfs)
+    :param info: MediaInfo of the source if it's already probed
+    :param codec: "ffv1" (lossless, compact) or "y4m" (raw, largest but cheapest to read)
+    :param on_progress: receives ffmpeg's progress blocks (see `progress.run_with_progress`)
+    :return: path of the intermediate and its MediaInfo
+    """
+    logger = logging.getLogger("convert_optimize")
+    info = info or probe(input_path)
+    cmd, path, mezzanine_info = mezzanine_command(input_path, directory, info, codec)
+    logger.info(f"Preparing the {codec} intermediate of {input_path} ({get_scalecrop_filter(info) or 'no filters'})")
+    with trace.span("mezzanine", input=input_path, codec=codec):
+        if on_progress is None:
+            run(cmd)
+        else:
+            run_with_progress(cmd, on_progress)
+    return path, mezzanine_info
+
+
+def mezzanine_command(input_path: str, directory: str, info: MediaInfo, codec: str = "ffv1"):
+    """
+    Command line of `prepare_mezzanine`.
+
+    :return: the command, the path of the intermediate and its MediaInfo
+    """
+    vf = get_scalecrop_filter(info)
+    if codec == "y4m":
+        path = os.path.join(directory, "mezzanine.y4m")
+        codec_args = ['-f', 'yuv4mpegpipe']
+    else:
+        path = os.path.join(directory, "mezzanine.mkv")
+        codec_args = ['-c:v', 'ffv1', '-level', '3', '-g', '1']
     cmd = [
-        'ffmpeg', '-strict', '-2', '-v', 'quiet', '-hide_banner', '-threads', '0', '-hwaccel', 'auto',
+        'ffmpeg', '-v', 'quiet', '-hide_banner', '-threads', '0', '-hwaccel', 'auto',
         '-i', input_path,
-        '-pass', '2', '-passlogfile', output_path,
-        '-c:v', 'libvpx-vp9', '-row-mt', '1',
-        '-b:v', str(vid_bps),
-        '-speed', '0', '-quality', 'best',
         '-map', 'v:0', '-an', '-pix_fmt', 'yuv420p',
-        '-timecode', '01:00:00:00',
         '-sws_flags', 'bicubic',
-        '-y', output_path
     ]
-    run(cmd)
+    if vf:
+        cmd += ['-vf', vf]
+    cmd += codec_args + ['-y', path]
+    fps = min(info.fps, 30) if info.fps else 30
+    return cmd, path, MediaInfo(path, info.duration, 512, 512, fps, codec, 'yuv420p', output_frames(info))
+
+
+def scratch_size(info: MediaInfo, mezzanine: str = "ffv1", target_size_kb: float = 255,
+                 max_encodes: int = 10) -> int:
+    """
+    Upper estimate of the scratch space of one conversion in bytes: the
+    intermediate, taken as raw 512x512 frames (ffv1 is smaller), and every
+    trial encode at up to twice the target size.
+    """
+    frame_bytes = 512 * 512 * 3 // 2 if mezzanine else 0
+    return output_frames(info) * frame_bytes + int(max_encodes * target_size_kb * 2048)
+
+
+def best_so_far(error: Cancelled, measured: List[Tuple[Sample, str]], target_size_kb: float):
+    """
+    Result of a search stopped by `error`: the largest complete encode under
+    the target so far. Re-raises `error` if there is none, or if its reason
+    isn't one of `cancel.KEEP_BEST`.
+
+    :param measured: (Sample, path) of every complete trial encode, in order
+    :return: SearchResult (`stopped` set to the reason) and the path of the kept encode
+    """
+    under = [i for i, (sample, _) in enumerate(measured) if sample.size_kb < target_size_kb]
+    if error.reason not in KEEP_BEST or not under:
+        raise error
+    chosen = max(under, key=lambda i: measured[i][0].size_kb)
+    best, path = measured[chosen]
+    logging.getLogger("convert_optimize").info(f"{error}, keeping the best encode so far: {best.size_kb:.2f} kb")
+    # the encode that was killed isn't one
+    result = SearchResult(best.bitrate, best.size_kb, len(measured), False, [sample for sample, _ in measured],
+                          stopped=error.reason, chosen=chosen)
+    return result, path
 
 
 def cleanup(path='.'):
     """
     Remove all files in `path` that end with .log or .log.mbtree
+
+    Note: this sweeps the whole directory, including files of other running
+    conversions. `convert_optimize` keeps its intermediates in a per-job
+    scratch directory (see `scratch.job_scratch`) and doesn't need it.
     """
     logger = logging.getLogger("cleanup")
 
@@ -148,73 +311,191 @@ def cleanup(path='.'):
 def convert(input_path: str, output_path: str, target_size_kb: float = 255):
     duration = get_duration(input_path)
     bitrate = estimate_bitrate(duration, target_size_kb)
-    vp9_pass1(input_path, output_path, bitrate)
-    vp9_pass2(input_path, output_path, bitrate)
-
-def convert_optimize(input_path: str, target_size_kb: float = 255, accuracy_kb: float = 5, progress_callback=None):
+    filters = get_scalecrop_filter(input_path)
+    vp9_pass1(input_path, output_path, bitrate, filters=filters)
+    vp9_pass2(input_path, output_path, bitrate, filters=filters)
+
+def convert_optimize(input_path: str, target_size_kb: float = 255, accuracy_kb: float = 5, progress_callback=None,
+                     reuse_analysis: bool = True, strategy="model", max_encodes: int = 10,
+                     calibrate: bool = False, threads: int = 0, memo: bool = True,
+                     mezzanine: str = "ffv1", sink: str = "ram", early_abort: bool = True,
+                     segments: int = 0, event_callback=None, sample_callback=None,
+                     prior_samples: List[Sample] = None, profile: str = None) -> SearchResult:
     """
-    Binary-search the target size in KB to find the optimal bitrate
-    that yields a file just under target_size_kb.
+    Search the bitrate that yields a file just under target_size_kb.
+
+    The search itself lives in `rate_control`; `strategy` picks how the next
+    bitrate is chosen from the (bitrate, size) points measured so far.
+    The default "model" strategy interpolates a log-linear size model and
+    usually lands inside `accuracy_kb` in 2-3 encodes, "bisect" is the plain
+    bracket bisection.
+
+    With `reuse_analysis` the first pass runs only once per input and every
+    search iteration runs just the second pass against its statistics.
+    The first pass stats of libvpx do not depend on the target bitrate, so
+    the result is the same at half the encodes.
+
+    With `calibrate` the search is seeded by a few fast low resolution proxy
+    encodes (see `calibration`) instead of `estimate_bitrate`, so usually only
+    one or two slow final-quality encodes follow.
+
+    With `memo` every measured (bitrate, size) sample is recorded in the local
+    `bitrate_memo`, and a clip seen before (or a re-exported copy of it)
+    starts from its stored curve, often needing a single final encode.
+    This takes precedence over `calibrate`. `prior_samples` (e.g. the trial
+    encodes of an interrupted run, see `journal`) seed the search the same way.
+
+    With `mezzanine` ("ffv1" or "y4m") the source is decoded and scaled once
+    into an intermediate in the scratch directory and every pass reads it
+    (see `prepare_mezzanine`). With None each pass decodes the source and
+    applies the scale/crop chain itself.
+
+    `threads` limits the encoder threads of every ffmpeg run, which matters
+    when several conversions share the machine (see `batch`). `profile` picks
+    the encoder settings (see `profiles`), "archival" by default.
+
+    All intermediate files (passlogs, trial encodes) are kept in a private
+    scratch directory of the job, the accepted encode is atomically renamed
+    into place, so concurrent conversions can't corrupt each other. Every
+    trial encode keeps its own file and the accepted one is the largest
+    under the target (see `rate_control.choose`), so the search never ends
+    on an oversized file and never re-encodes an earlier bitrate.
+    `sink` picks where that directory lives: "ram" (default) keeps it on a
+    RAM-backed file system, so search iterations never touch the source disk
+    and only the accepted encode is written to the destination, once;
+    "disk" keeps it next to the output. A RAM file system without room for
+    the job (see `scratch.scratch_root`) falls back to "disk".
+
+    With `early_abort` each trial encode is watched while it runs and
+    stopped as soon as it clearly overshoots the target (see `OvershootGuard`);
+    its extrapolated size still bounds the search from above, unless a
+    complete encode contradicts it.
+
+    With `segments` > 1 long clips are encoded as that many keyframe-aligned
+    chunks in parallel (see `segments.SegmentedEncoder`), which keeps many
+    cores busy where a single libvpx encode can't. Needs the intermediate;
+    trial encodes are not aborted early in this mode.
+
+    `progress_callback` receives the number of each trial encode as it starts.
+    `event_callback` receives fine-grained `progress.ProgressEvent`s (frame,
+    fps, out_time, size, speed) of the intermediate, analysis and encode passes.
+    `sample_callback` receives the Sample of every trial encode once it's measured.
+
+    Run inside `cancel.scope` the conversion can be cancelled or time out:
+    the running ffmpeg is killed and the largest complete under-target encode
+    so far becomes the output (`SearchResult.stopped` tells why). Without
+    one, or if the job was cancelled for another reason than those in
+    `cancel.KEEP_BEST`, Cancelled is raised and no output is written.
     """
     logger = logging.getLogger("convert_optimize")
     output_path = os.path.splitext(input_path)[0] + ".webm"
-    # search bounds in KB
-    test_bitrate = estimate_bitrate(get_duration(input_path), target_size_kb)
-    logger.info(f"Doing a test run with bitrate {test_bitrate / 1000:.2f} kbps ...")
-    if progress_callback:
-        progress_callback(1)
-    vp9_pass1(input_path, output_path, test_bitrate)
-    vp9_pass2(input_path, output_path, test_bitrate)
-    actual_kb = os.path.getsize(output_path) / 1024
-
-    if actual_kb > target_size_kb:
-        logger.info(f"Exceeded target file size with {actual_kb}, starting a search")
-    else:
-        logger.info(f"Worked, staying at {test_bitrate:.2f} kbps")
-        logger.info(f"Final size: {os.path.getsize(output_path) / 1024:.2f} kb")
-        return
-
-    scale_coef = 255 / actual_kb
-    high = test_bitrate * scale_coef
-    low = high - test_bitrate * (1 - scale_coef)
-    best_bitrate = (high + low) / 2
-    last_loop = False
-
-
-    # limited iterations to avoid infinite loop
-    for iteration in range(1, 9):
-        if progress_callback:
-            progress_callback(iteration + 1)
-
-        logger.info(f"Encoding with bitrate {best_bitrate/1000:.2f} kbps. Iteration {iteration} / 9")
-        vp9_pass1(input_path, output_path, best_bitrate)
-        vp9_pass2(input_path, output_path, best_bitrate)
-        actual_kb = os.path.getsize(output_path) / 1024
-        logger.info(f"Encoded file size: {actual_kb:.2f} kb")
-        if last_loop:
-            break
-
-        if actual_kb > target_size_kb:
-            logger.info(f"Exceeded target file size with {actual_kb}, setting bitrate top limit to {best_bitrate/1000:.2f} kbps")
-            high = best_bitrate
-        else:
-            logger.info(f"Worked!")
-            low = best_bitrate
-
-        if 0 < (target_size_kb - actual_kb) < accuracy_kb:
-            logger.info(f"{target_size_kb - accuracy_kb} kb < [{actual_kb} kb] < {target_size_kb} kb")
-            logger.info(f"Breaking the loop")
-            break
+    options = dict(threads=threads, profile=profile)
+
+    info = probe(input_path)
+    root = scratch_root(sink, scratch_size(info, mezzanine, target_size_kb, max_encodes))
+    with job_scratch(output_path, root) as scratch:
+        # every trial encode keeps its own file, the chosen one is promoted without re-encoding
+        trial_paths = []
+        passlog = os.path.join(scratch, "analysis") if reuse_analysis else None
+
+        def watch(stage, total_frames, iteration=0, guard=None):
+            if event_callback is None:
+                return guard
+            return reporter(event_callback, stage, iteration, total_frames, guard)
+
+        duration = info.duration
+        # frames every pass writes, whether it reads the intermediate or the source
+        frames = output_frames(info)
+        if mezzanine:
+            source, source_info = prepare_mezzanine(input_path, scratch, info, mezzanine,
+                                                    on_progress=watch("mezzanine", frames))
         else:
-            if iteration == 9:
-                last_loop = True
-            best_bitrate = (high + low) / 2
-            low = low - 2 * target_size_kb
-            logger.info(f"Trying bitrate: {best_bitrate / 1000:.2f} kbps")
-
-
-
-
-    logger.info(f"Success!")
-    logger.info(f"Optimal bitrate: {best_bitrate / 1000:.2f} kbps")
+            source, source_info = input_path, info
+            options["filters"] = get_scalecrop_filter(info)
+
+        segmenter = None
+        if segments > 1:
+            if not mezzanine:
+                raise ValueError("Segmented encoding needs the intermediate, set mezzanine")
+            from .segments import SegmentedEncoder
+            segmenter = SegmentedEncoder(source, source_info, scratch, segments, threads, profile=profile)
+            if len(segmenter) < 2:
+                logger.info("The clip is too short to split, encoding it in one piece")
+                segmenter = None
+
+        # complete encodes so far, for a cancelled search
+        measured = []
+
+        def encode(vid_bps, abortable=early_abort):
+            trial = len(trial_paths) + 1
+            trial_path = os.path.join(scratch, f"trial{trial:02d}.webm")
+            trial_paths.append(trial_path)
+            started = time.perf_counter()
+            if segmenter:
+                segmenter.encode(vid_bps, trial_path)
+            else:
+                if not reuse_analysis:
+                    vp9_pass1(source, trial_path, vid_bps, on_progress=watch("analysis", frames, trial),
+                              **options)
+                guard = OvershootGuard(target_size_kb, frames) if abortable else None
+                if not vp9_pass2(source, trial_path, vid_bps, passlogfile=passlog,
+                                 on_progress=watch("encode", frames, trial, guard), **options):
+                    raise Overshoot(guard.projected_kb)
+            size_kb = os.path.getsize(trial_path) / 1024
+            measured.append((Sample(vid_bps, size_kb, seconds=time.perf_counter() - started), trial_path))
+            return size_kb
+
+        test_bitrate = estimate_bitrate(duration, target_size_kb)
+        calibration = None
+        known = list(prior_samples or [])
+        if memo:
+            bitrate_memo = BitrateMemo(profile=profile, mezzanine=mezzanine)
+            digest = file_digest(input_path)
+            known += bitrate_memo.samples_for(input_path, info, digest)
+        remembered = warm_start(known, target_size_kb, accuracy_kb)
+        if remembered:
+            test_bitrate = remembered
+        elif calibrate:
+            from .calibration import calibrate as run_calibration
+            with trace.span("calibration", input=input_path):
+                calibration = run_calibration(source, test_bitrate, target_size_kb, accuracy_kb,
+                                              scratch_dir=scratch, info=source_info, profile=profile,
+                                              mezzanine=mezzanine)
+            test_bitrate = calibration.seed_bitrate
+        if segmenter:
+            logger.info(f"Analyzing {input_path} (complexity and first passes of {len(segmenter)} segments) ...")
+            segmenter.prepare(test_bitrate)
+        elif reuse_analysis:
+            logger.info(f"Analyzing {input_path} (first pass) ...")
+            vp9_pass1(source, os.path.join(scratch, "analysis.webm"), test_bitrate, passlogfile=passlog,
+                      on_progress=watch("analysis", frames), **options)
+        logger.info(f"Doing a test run with bitrate {test_bitrate / 1000:.2f} kbps ...")
+        try:
+            result = search(encode, test_bitrate, target_size_kb, accuracy_kb,
+                            strategy=strategy, max_encodes=max_encodes, progress_callback=progress_callback,
+                            sample_callback=sample_callback)
+            if result.chosen is None:
+                # every trial was aborted over the target, so there's no file yet:
+                # finish one below them without the guard
+                bitrate = fallback_bitrate(result.samples, target_size_kb, accuracy_kb)
+                logger.info(f"Finishing the encode with bitrate {bitrate / 1000:.2f} kbps")
+                started = time.perf_counter()
+                sample = Sample(bitrate, encode(bitrate, abortable=False), seconds=time.perf_counter() - started)
+                if sample_callback:
+                    sample_callback(sample)
+                result.settle(sample, target_size_kb, accuracy_kb)
+            chosen_path = trial_paths[result.chosen]
+        except Cancelled as e:
+            result, chosen_path = best_so_far(e, measured, target_size_kb)
+        promote(chosen_path, output_path)
+        if memo:
+            bitrate_memo.record(input_path, info, result.samples, digest)
+
+    logger.info(f"Stopped early ({result.stopped})" if result.stopped else "Success!")
+    logger.info(f"Optimal bitrate: {result.bitrate / 1000:.2f} kbps")
     logger.info(f"Final size: {os.path.getsize(output_path) / 1024:.2f} kb")
+    logger.info(f"Used {result.encodes} encodes")
+    if calibration and result.converged:
+        from .calibration import update_ratio
+        update_ratio(calibration, result.bitrate)
+    return result
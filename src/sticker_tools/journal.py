@@ -0,0 +1,127 @@
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+from .patch_duration import read_duration
+from .rate_control import Sample
+
+# a patched output must have this duration to count as finished
+PATCHED_SECONDS = 1.0
+
+
+class Journal:
+    """
+    Append-only record of batch job states, one JSON line per event:
+    "started" (input size and mtime), "probed" (duration), "sample" (one
+    trial encode), "encoded" (the accepted bitrate, once the output is in
+    place) and "patched" (output size and job status). A line is written and flushed in one call, so
+    worker processes can share the file and a crash loses at most the event
+    being written.
+
+    `replay` folds the file into the last known state of every input, which
+    `run_batch` uses to skip finished files and warm-start interrupted ones.
+
+    :param path: journal file, created on the first event
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def record(self, input_path: str, event: str, **data) -> None:
+        line = json.dumps(dict(file=os.path.abspath(input_path), event=event, time=time.time(), **data))
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def started(self, input_path: str) -> None:
+        stat = os.stat(input_path)
+        self.record(input_path, "started", size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+    def sample_recorder(self, input_path: str):
+        """
+        `sample_callback` for `convert_optimize` that journals every trial encode.
+        """
+        def record(sample: Sample):
+            self.record(input_path, "sample", bitrate=sample.bitrate, size_kb=sample.size_kb,
+                        partial=sample.partial)
+        return record
+
+    def repair(self) -> None:
+        """
+        Cuts off a torn last line (a crash while writing), so the next event starts on a line of its own.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def replay(self) -> Dict[str, dict]:
+        """
+        Last known state of every input: {"size", "mtime_ns", "duration",
+        "samples", "bitrate", "output", "size_kb", "status", "stage"}, where "stage" is
+        the last event. A torn last line is ignored (see `repair`).
+        """
+        states = {}
+        if not os.path.exists(self.path):
+            return states
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                event = entry.pop("event")
+                path = entry.pop("file")
+                entry.pop("time", None)
+                if event == "started":
+                    # a new attempt: forget the outputs, keep the samples if the input didn't change
+                    old = states.get(path, {})
+                    same = (old.get("size"), old.get("mtime_ns")) == (entry["size"], entry["mtime_ns"])
+                    states[path] = dict(entry, samples=old.get("samples", []) if same else [])
+                    continue
+                state = states.setdefault(path, {"samples": []})
+                if event == "sample":
+                    state["samples"].append(entry)
+                else:
+                    state.update(entry)
+                state["stage"] = event
+        return states
+
+
+def is_finished(input_path: str, state: Optional[dict]) -> bool:
+    """
+    True if the journal says the input was converted and patched (and not
+    stopped by a timeout) and the output on disk still matches: the input is unchanged, the output has
+    the recorded size and its Duration element holds the patched value.
+    """
+    if not state or state.get("stage") != "patched" or state.get("status") != "success":
+        return False
+    try:
+        stat = os.stat(input_path)
+        if (stat.st_size, stat.st_mtime_ns) != (state.get("size"), state.get("mtime_ns")):
+            return False
+        output = state["output"]
+        if abs(os.path.getsize(output) / 1024 - state["size_kb"]) > 1e-6:
+            return False
+        return abs(read_duration(output) - PATCHED_SECONDS) < 1e-3
+    except (OSError, ValueError, KeyError, RuntimeError, EOFError):
+        return False
+
+
+def recorded_samples(input_path: str, state: Optional[dict]) -> List[Sample]:
+    """
+    Complete trial encodes journaled for an unchanged input, to warm-start its search.
+    """
+    if not state:
+        return []
+    try:
+        stat = os.stat(input_path)
+    except OSError:
+        return []
+    if (stat.st_size, stat.st_mtime_ns) != (state.get("size"), state.get("mtime_ns")):
+        return []
+    return [Sample(s["bitrate"], s["size_kb"]) for s in state.get("samples", []) if not s.get("partial")]
@@ -1,21 +1,103 @@
+import io
 import struct
-from typing import Tuple
+from typing import BinaryIO, Tuple
 import logging
 
 logging.basicConfig(level=logging.INFO)
 
+# EBML element IDs (with their length marker bits, as they appear in the file)
+EBML_ID = 0x1A45DFA3
+SEGMENT_ID = 0x18538067
+INFO_ID = 0x1549A966
+DURATION_ID = 0x4489
+CLUSTER_ID = 0x1F43B675
+
+
+def read_element_header(f: BinaryIO) -> Tuple[int, int, int]:
+    """
+    Reads the header of the EBML element at the current position of `f`:
+    the element ID and the VINT with the payload size. Leaves `f` at the
+    start of the payload.
+
+    :param f: binary file object positioned at an element
+    :return: element ID, payload size (-1 if unknown) and the position of the size VINT
+    """
+    first = f.read(1)
+    if not first:
+        raise EOFError("No more EBML elements")
+    id_length = 9 - first[0].bit_length()
+    if not 1 <= id_length <= 4:
+        raise ValueError(f"Invalid EBML element ID at {f.tell() - 1}")
+    id_bytes = first + f.read(id_length - 1)
+    if len(id_bytes) != id_length:
+        raise ValueError("Truncated EBML element ID")
+    element_id = int.from_bytes(id_bytes, "big")
+
+    size_idx = f.tell()
+    first = f.read(1)
+    if not first:
+        raise ValueError("Truncated EBML element size")
+    size_length = 9 - first[0].bit_length() if first[0] else 9
+    size_bytes = first + f.read(size_length - 1)
+    vint_length, payload_size = parse_vint(size_bytes, 0)
+    # a VINT with all value bits set means "unknown size" (live streams)
+    if payload_size == (1 << (7 * vint_length)) - 1:
+        payload_size = -1
+    return element_id, payload_size, size_idx
+
+
+def locate_duration(f: BinaryIO) -> int:
+    """
+    Walks EBML -> Segment -> Info -> Duration by element IDs and sizes,
+    reading only element headers and seeking over everything else.
+
+    :param f: binary file object of a .webm/.mkv file
+    :return: position of the size VINT of the Duration element
+    """
+    f.seek(0)
+    element_id, size, _ = read_element_header(f)
+    if element_id != EBML_ID:
+        raise RuntimeError("Not an EBML file")
+    f.seek(size, io.SEEK_CUR)
+
+    element_id, segment_size, _ = read_element_header(f)
+    if element_id != SEGMENT_ID:
+        raise RuntimeError(f"Expected a Segment element, found 0x{element_id:X}")
+    segment_end = f.tell() + segment_size if segment_size >= 0 else None
+
+    while segment_end is None or f.tell() < segment_end:
+        try:
+            element_id, size, _ = read_element_header(f)
+        except EOFError:
+            break
+        if element_id == INFO_ID:
+            info_end = f.tell() + size
+            while f.tell() < info_end:
+                child_id, child_size, size_idx = read_element_header(f)
+                if child_id == DURATION_ID:
+                    return size_idx
+                f.seek(child_size, io.SEEK_CUR)
+            break
+        if element_id == CLUSTER_ID or size < 0:
+            # media data starts, the Info element should have come before it
+            break
+        f.seek(size, io.SEEK_CUR)
+    raise RuntimeError(b"Could not find vint idx \x44\x89")
+
+
 def find_duration_vint_idx(data: bytes) -> int:
     """
     Parses the binary data and identifies the location of the 0x4489 byte
     which is the EBML element ID for the Duration field in a Matroska/WebM file
 
-    :param data: data stream read from .webm file
+    The element tree is walked (EBML -> Segment -> Info -> Duration), so a
+    0x4489 sequence inside other elements or cluster data can't be mistaken
+    for the Duration element.
+
+    :param data: data stream read from .webm file (at least up to the Info element)
     :return: index location of the duration field
     """
-    idx = data.find(b'\x44\x89')
-    if idx == -1:
-        raise RuntimeError(b"Could not find vint idx \x44\x89")
-    return idx + 2
+    return locate_duration(io.BytesIO(data))
 
 def parse_vint(data: bytes, vint_idx: int) -> Tuple[int, int]:
     """
@@ -57,53 +139,66 @@ def parse_vint(data: bytes, vint_idx: int) -> Tuple[int, int]:
         payload_size = (payload_size << 8) | data[vint_idx + i]
     return vint_length, payload_size
 
-def read_duration(filename: str) -> int:
+def _read_duration_field(f: BinaryIO) -> Tuple[int, int, float]:
+    """
+    Locates the Duration element and reads its value.
+
+    :return: payload position, payload size and the duration in seconds
     """
-    Reads and returns the duration of the video in seconds
+    vint_idx = locate_duration(f)
+    f.seek(vint_idx)
+    header = f.read(8)
+    vint_length, payload_size = parse_vint(header, 0)
+    start_idx = vint_idx + vint_length
+    f.seek(start_idx)
+    duration_field = f.read(payload_size)
+    if len(duration_field) != payload_size:
+        raise ValueError("Unexpected EOF while reading duration")
+
+    if payload_size == 4:
+        # big-endian float
+        return start_idx, payload_size, struct.unpack(">f", duration_field)[0] / 1e3
+    elif payload_size == 8:
+        # big-endian double
+        return start_idx, payload_size, struct.unpack(">d", duration_field)[0] / 1e3
+    else:
+        raise ValueError(f"Unknown duration size: {payload_size} bytes")
+
+
+def _write_duration_field(f: BinaryIO, start_idx: int, payload_size: int, new_seconds: float) -> None:
+    raw_ticks = new_seconds * 1000
+    if payload_size == 4:
+        packed = struct.pack(">f", raw_ticks)
+    elif payload_size == 8:
+        packed = struct.pack(">d", raw_ticks)
+    else:
+        raise ValueError(f"Cannot patch duration of {payload_size} bytes")
+    f.seek(start_idx)
+    f.write(packed)
+
+
+def read_duration(filename: str) -> float:
+    """
+    Reads and returns the duration of the video in seconds.
+    Only the element headers up to the Duration element are read.
 
     :param filename: Existing .webm file to read
     :return: duration in seconds
     """
     with open(filename, "rb") as f:
-        data = f.read()
-        vint_idx = find_duration_vint_idx(data)
-        vint_length, payload_size = parse_vint(data, vint_idx)
-        start_idx = vint_idx + vint_length
-        duration_field = data[start_idx:start_idx + payload_size]
-        if len(duration_field) != payload_size:
-            raise ValueError("Unexpected EOF while reading duration")
-
-        if payload_size == 4:
-            # big-endian float
-            return struct.unpack(">f", duration_field)[0] / 1e3
-        elif payload_size == 8:
-            # big-endian double
-            return struct.unpack(">d", duration_field)[0] / 1e3
-        else:
-            raise ValueError(f"Unknown duration size: {payload_size} bytes")
+        return _read_duration_field(f)[2]
 
 
 def write_duration(filename: str, new_seconds: float) -> None:
     """
-    Reads the file and alters the duration field
+    Alters the duration field in place with a single seek and write.
 
     :param filename: Name of the existing .webm file
     :param new_seconds: new duration in seconds
     """
-    raw_ticks = new_seconds * 1000
-
     with open(filename, "r+b") as f:
-        data = f.read()
-        vint_idx =  find_duration_vint_idx(data)
-        vint_length, payload_size = parse_vint(data, vint_idx)
-        start_idx = vint_idx + vint_length
-        f.seek(start_idx)
-        if payload_size == 4:
-            f.write(struct.pack(">f", raw_ticks))
-        elif payload_size == 8:
-            f.write(struct.pack(">d", raw_ticks))
-        else:
-            raise ValueError(f"Cannot patch duration of {payload_size} bytes")
+        start_idx, payload_size, _ = _read_duration_field(f)
+        _write_duration_field(f, start_idx, payload_size, new_seconds)
 
 
 def patch_duration(filename: str, new_seconds: float = 1) -> None:
@@ -113,10 +208,12 @@ def patch_duration(filename: str, new_seconds: float = 1) -> None:
     :param new_seconds: new duration in seconds
     """
     logger = logging.getLogger("patch_duration")
-    duration = read_duration(filename)
-    logger.info(f"Read the file {filename}. Determined duration: {duration} sec")
-    write_duration(filename, new_seconds)
-    logger.info(f"Patching the file...")
-    duration = read_duration(filename)
-    logger.info(f"Reading the file again. Determined duration: {duration} sec")
+    with open(filename, "r+b") as f:
+        start_idx, payload_size, duration = _read_duration_field(f)
+        logger.info(f"Read the file {filename}. Determined duration: {duration} sec")
+        _write_duration_field(f, start_idx, payload_size, new_seconds)
+        logger.info(f"Patching the file...")
+        f.flush()
+        duration = _read_duration_field(f)[2]
+        logger.info(f"Reading the file again. Determined duration: {duration} sec")
     logger.info(f"Success!")
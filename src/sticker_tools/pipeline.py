@@ -0,0 +1,149 @@
+import os
+import time
+from dataclasses import dataclass, asdict
+from typing import List
+
+from .cancel import CancelToken, scope
+from .convert_optimize import convert_optimize
+from .journal import Journal
+from .patch_duration import patch_duration
+from .probe import probe
+from .result_cache import ResultCache
+from .webm_inspect import inspect
+from . import trace as tracing
+
+# convert_optimize options that don't change the produced file
+NON_RESULT_OPTIONS = ("threads", "sink", "event_callback", "sample_callback", "prior_samples")
+
+
+@dataclass(slots=True)
+class JobResult:
+    """
+    Outcome of processing one input file.
+
+    :param input_path: source file
+    :param output_path: produced (or patched) .webm
+    :param status: "success", "error", "cancelled"/"timeout" if the job was stopped and the output is
+        the best encode found until then, or "over_target" if no encode fit and the output is the smallest
+    :param size_kb: size of the output in KB
+    :param bitrate: bitrate of the output in bps, None if only patched
+    :param encodes: number of trial encodes, 0 if only patched
+    :param seconds: wall time of the job
+    :param error: error message if the job failed
+    :param cached: True if the output came from the result cache
+    :param trace: timing records of the job's stages (see `trace.Tracer`) if it was traced
+    :param history: one record per trial encode of the search (see `SearchResult.history`)
+    :param resumed: True if a journal showed the file finished by an earlier run and the output checked out
+    """
+    input_path: str
+    output_path: str
+    status: str = "success"
+    size_kb: float = None
+    bitrate: float = None
+    encodes: int = 0
+    seconds: float = 0.0
+    error: str = None
+    cached: bool = False
+    trace: List[dict] = None
+    history: List[dict] = None
+    resumed: bool = False
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def check_sticker(path: str) -> None:
+    """
+    Raises ValueError if a .webm input is not a video sticker Telegram would
+    accept (see `webm_inspect`): patching it anyway only hides the problem.
+    """
+    report = inspect(path, patched=False)
+    if report.status != "ok":
+        raise ValueError(f"{path} is not a valid video sticker: {report.error or '; '.join(report.problems)}")
+
+
+def make_sticker(input_path: str, target_size_kb: float = 255, accuracy_kb: float = 5,
+                 progress_callback=None, cache: ResultCache = None, trace: bool = False,
+                 cancel: CancelToken = None, timeout: float = None, journal: str = None,
+                 **options) -> JobResult:
+    """
+    Full sticker pipeline for one file: .webm files are only checked (see
+    `webm_inspect`) and patched, anything else is converted with
+    `convert_optimize` and patched afterwards.
+
+    :param input_path: file to process
+    :param cache: ResultCache to look the finished sticker up in and store it to, None to bypass
+    :param trace: record wall time, child CPU time and peak RSS of every stage into `JobResult.trace`
+    :param cancel: CancelToken to stop the job from another thread
+    :param timeout: time budget of the job in seconds; when it runs out the running ffmpeg is killed
+        and the best under-target encode so far is kept, or `cancel.Cancelled` is raised if there is none
+    :param journal: append the states of the conversion (probed, trial encodes, encoded, patched) to this
+        `journal.Journal` file, so an interrupted batch can be resumed
+    :param options: passed to `convert_optimize` (strategy, calibrate, threads, event_callback, ...)
+    :return: JobResult, errors are raised
+    """
+    if trace:
+        with tracing.tracing() as tracer:
+            with tracing.span("job", input=input_path):
+                result = make_sticker(input_path, target_size_kb, accuracy_kb, progress_callback, cache,
+                                      cancel=cancel, timeout=timeout, journal=journal, **options)
+        result.trace = tracer.records
+        return result
+    if cancel is not None or timeout is not None:
+        token = cancel or CancelToken()
+        if timeout is not None:
+            token.timeout = timeout
+        with scope(token):
+            return make_sticker(input_path, target_size_kb, accuracy_kb, progress_callback, cache,
+                                journal=journal, **options)
+
+    started = time.perf_counter()
+    ext = os.path.splitext(input_path)[1].lower()
+    output_path = os.path.splitext(input_path)[0] + ".webm"
+    result = JobResult(input_path, output_path)
+    if ext == ".webm":
+        # the input is the output: patching it again is all a rerun would do, nothing to journal
+        journal = None
+        check_sticker(input_path)
+        with tracing.span("patch", output=output_path):
+            patch_duration(output_path)
+    else:
+        if journal is not None:
+            journal = Journal(journal)
+            journal.started(input_path)
+            journal.record(input_path, "probed", duration=probe(input_path).duration)
+            options["sample_callback"] = journal.sample_recorder(input_path)
+        key = None
+        if cache is not None:
+            params = {k: v for k, v in options.items() if k not in NON_RESULT_OPTIONS}
+            key = cache.key(input_path, target_size_kb=target_size_kb, accuracy_kb=accuracy_kb, **params)
+            metadata = cache.get(key, output_path)
+            if metadata is not None:
+                result.bitrate = metadata.get("bitrate")
+                result.cached = True
+        if not result.cached:
+            search_result = convert_optimize(input_path, target_size_kb, accuracy_kb,
+                                             progress_callback=progress_callback, **options)
+            result.bitrate = search_result.bitrate
+            result.encodes = search_result.encodes
+            result.history = search_result.history()
+            if journal is not None:
+                journal.record(input_path, "encoded", output=os.path.abspath(output_path),
+                               bitrate=result.bitrate, encodes=result.encodes)
+            with tracing.span("patch", output=output_path):
+                patch_duration(output_path)
+            if search_result.stopped:
+                # usable, but not what an unhurried search would produce: don't cache it
+                result.status = search_result.stopped
+                result.error = f"stopped after {result.encodes} encodes, kept the best encode so far"
+            elif search_result.size_kb >= target_size_kb:
+                result.status = "over_target"
+                result.error = f"no encode fit under {target_size_kb} kb, kept the smallest"
+            elif key is not None:
+                cache.put(key, output_path, {"bitrate": result.bitrate, "encodes": result.encodes})
+    result.size_kb = os.path.getsize(output_path) / 1024
+    if journal is not None:
+        journal.record(input_path, "patched", output=os.path.abspath(output_path), size_kb=result.size_kb,
+                       bitrate=result.bitrate, status=result.status)
+    result.seconds = time.perf_counter() - started
+    return result
@@ -0,0 +1,120 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from .process import run
+from . import trace
+
+# number of probed files remembered by `probe`
+PROBE_CACHE_SIZE = 256
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+class MediaInfo:
+    """
+    Properties of the first video stream of a file, as reported by ffprobe.
+
+    :param path: probed file
+    :param duration: container duration in seconds
+    :param width: frame width in pixels
+    :param height: frame height in pixels
+    :param fps: average frame rate, 0 if unknown
+    :param codec: codec name (h264, hevc, vp9, ...)
+    :param pix_fmt: pixel format (yuv420p, ...)
+    :param frames: number of frames; estimated from duration and fps if the container doesn't store it
+    """
+    __slots__ = ("path", "duration", "width", "height", "fps", "codec", "pix_fmt", "frames")
+
+    def __init__(self, path, duration, width, height, fps, codec, pix_fmt, frames):
+        self.path = path
+        self.duration = duration
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.codec = codec
+        self.pix_fmt = pix_fmt
+        self.frames = frames
+
+    def __repr__(self):
+        return (f"MediaInfo({self.path!r}, {self.width}x{self.height}, {self.fps:.2f} fps, "
+                f"{self.duration:.2f} s, {self.frames} frames, {self.codec}/{self.pix_fmt})")
+
+
+def _parse_rate(rate: str) -> float:
+    num, _, den = (rate or "0/1").partition("/")
+    try:
+        num, den = float(num), float(den or 1)
+    except ValueError:
+        return 0.0
+    return num / den if den else 0.0
+
+
+def ffprobe_command(path: str) -> list:
+    return [
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'format=duration:stream=width,height,avg_frame_rate,codec_name,pix_fmt,nb_frames,duration',
+        '-of', 'json', path
+    ]
+
+
+def _ffprobe(path: str) -> MediaInfo:
+    with trace.span("ffprobe", input=path):
+        result = run(ffprobe_command(path), capture_output=True, text=True, check=True)
+    return parse_ffprobe(path, result.stdout)
+
+
+def parse_ffprobe(path: str, output: str) -> MediaInfo:
+    """
+    MediaInfo from the JSON output of `ffprobe_command`.
+    """
+    info = json.loads(output)
+    stream = info["streams"][0]
+    duration = float(info.get("format", {}).get("duration") or stream.get("duration") or 0)
+    fps = _parse_rate(stream.get("avg_frame_rate"))
+    frames = stream.get("nb_frames")
+    frames = int(frames) if frames and frames.isdigit() else round(duration * fps)
+    return MediaInfo(path, duration, int(stream["width"]), int(stream["height"]), fps,
+                     stream.get("codec_name"), stream.get("pix_fmt"), frames)
+
+
+def probe(path: str) -> MediaInfo:
+    """
+    Probes `path` with a single ffprobe call. Results are memoized per
+    (path, modification time, size), so the whole pipeline can ask again
+    without spawning another process; a changed file is probed anew.
+
+    :param path: media file
+    :return: MediaInfo
+    """
+    key = cache_key(path)
+    info = cached(key)
+    if info is None:
+        info = _ffprobe(path)
+        remember(key, info)
+    return info
+
+
+def cache_key(path: str) -> tuple:
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+
+def cached(key: tuple):
+    """
+    MediaInfo memoized under a `cache_key`, None if the file wasn't probed yet.
+    """
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    return None
+
+
+def remember(key: tuple, info: MediaInfo) -> None:
+    with _lock:
+        _cache[key] = info
+        while len(_cache) > PROBE_CACHE_SIZE:
+            _cache.popitem(last=False)
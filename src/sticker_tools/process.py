@@ -0,0 +1,123 @@
+import os
+import platform
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+from . import cancel, trace
+
+
+def _hide_window(kwargs):
+    # on Windows add the no-window flags …
+    if sys.platform == "win32":
+        kwargs.setdefault("creationflags", subprocess.CREATE_NO_WINDOW)
+        si = subprocess.STARTUPINFO()
+        si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        si.wShowWindow = subprocess.SW_HIDE
+        kwargs.setdefault("startupinfo", si)
+    return kwargs
+
+
+def _drain(process: subprocess.Popen, input=None):
+    # Popen.communicate without its final wait, so `reap` is the one reaping the child
+    output = {}
+
+    def read(name):
+        with getattr(process, name) as stream:
+            output[name] = stream.read()
+
+    readers = [threading.Thread(target=read, args=(name,), daemon=True)
+               for name in ("stdout", "stderr") if getattr(process, name) is not None]
+    for reader in readers:
+        reader.start()
+    if process.stdin is not None:
+        try:
+            if input is not None:
+                process.stdin.write(input)
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+    for reader in readers:
+        reader.join()
+    return output.get("stdout"), output.get("stderr")
+
+
+def reap(process: subprocess.Popen) -> int:
+    """
+    Waits for `process` to exit. Where there is `os.wait4` the child is
+    reaped with it and its resource usage goes to the spans of the calling
+    context (see `trace.child_exited`).
+
+    :return: the exit code
+    """
+    if hasattr(os, "wait4") and process.returncode is None:
+        try:
+            _, status, rusage = os.wait4(process.pid, 0)
+        except ChildProcessError:
+            # already reaped by a poll() of another thread, e.g. the kill of a CancelToken
+            pass
+        else:
+            process.returncode = os.waitstatus_to_exitcode(status)
+            trace.child_exited(rusage)
+    return process.wait()
+
+
+def run(cmd, check: bool = True, capture_output: bool = False, input=None, **kwargs) -> subprocess.CompletedProcess:
+    """
+    `subprocess.run` with the Windows flags of `_hide_window`, the child is reaped by `reap`.
+    Inside a cancellable job the process is killed when the job's CancelToken is cancelled.
+    """
+    _hide_window(kwargs)
+    # **don’t** do: kwargs.setdefault("stdout", PIPE) or stderr here
+    if capture_output:
+        kwargs["stdout"] = kwargs["stderr"] = subprocess.PIPE
+    if input is not None:
+        kwargs["stdin"] = subprocess.PIPE
+
+    # inside a cancellable job the process must be killable from another thread
+    token = cancel.current()
+    if token is not None:
+        token.check()
+    with subprocess.Popen(cmd, **kwargs) as process:
+        if token is not None:
+            token.attach(process)
+        try:
+            stdout, stderr = _drain(process, input)
+            reap(process)
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            if token is not None:
+                token.detach(process)
+    if token is not None:
+        token.check()
+    if check and process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+
+def popen(cmd, **kwargs) -> subprocess.Popen:
+    """
+    Starts `cmd` without waiting for it, with the same Windows flags as `run`.
+    Inside a cancellable job the process is attached to the job's CancelToken;
+    the caller waits for it with `reap` and detaches it once it has exited.
+    """
+    token = cancel.current()
+    if token is not None:
+        token.check()
+    process = subprocess.Popen(cmd, **_hide_window(kwargs))
+    if token is not None:
+        token.attach(process)
+    return process
+
+
+if platform.system() == 'Windows':
+    if getattr(sys, 'frozen', False):
+        base = Path(sys._MEIPASS)
+    else:
+        # when running from source, project root is two levels up
+        base = Path(__file__).resolve().parents[2]
+    bin_dir = base / 'bin'
+    os.environ['PATH'] = str(bin_dir) + os.pathsep + os.environ.get('PATH', '')
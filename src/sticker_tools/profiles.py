@@ -0,0 +1,110 @@
+import json
+from dataclasses import dataclass, asdict, fields
+from typing import List, Union
+
+from .storage import data_dir
+
+# profile written by `tuning` for this machine
+TUNED = "tuned"
+TUNED_FILE = "encoder_profile.json"
+
+
+@dataclass(slots=True)
+class EncoderProfile:
+    """
+    libvpx-vp9 settings of the encode passes. None leaves a setting at the encoder's default.
+
+    :param name: profile name
+    :param speed: `-speed` of the second pass, lower is slower and better
+    :param quality: `-quality` (deadline): best, good or realtime
+    :param analysis_speed: `-speed` of the first pass, defaults to `speed`; the first pass only
+        gathers statistics, so it can run much faster than the encode
+    :param tile_columns: `-tile-columns` (log2), a 512 px frame has at most 2 tile columns
+    :param lag_in_frames: `-lag-in-frames`, look-ahead of the rate control and the alt-ref frames
+    :param auto_alt_ref: `-auto-alt-ref`, 0 disables the hidden alt-ref frames
+    :param frame_parallel: `-frame-parallel`, decodable in parallel at a small quality cost
+    """
+    name: str
+    speed: int = 0
+    quality: str = "best"
+    analysis_speed: int = None
+    tile_columns: int = None
+    lag_in_frames: int = None
+    auto_alt_ref: int = None
+    frame_parallel: bool = None
+
+    def pass_speed(self, pass_no: int) -> int:
+        if pass_no == 1 and self.analysis_speed is not None:
+            return self.analysis_speed
+        return self.speed
+
+    def encoder_args(self) -> List[str]:
+        """
+        ffmpeg options of the settings that differ from the encoder defaults.
+        """
+        args = []
+        if self.tile_columns is not None:
+            args += ['-tile-columns', str(self.tile_columns)]
+        if self.lag_in_frames is not None:
+            args += ['-lag-in-frames', str(self.lag_in_frames)]
+        if self.auto_alt_ref is not None:
+            args += ['-auto-alt-ref', str(self.auto_alt_ref)]
+        if self.frame_parallel is not None:
+            args += ['-frame-parallel', str(int(self.frame_parallel))]
+        return args
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+PROFILES = {
+    # previews: several times faster, slightly softer
+    "draft": EncoderProfile("draft", speed=5, quality="good", analysis_speed=5, tile_columns=1, lag_in_frames=0,
+                            auto_alt_ref=0, frame_parallel=True),
+    "balanced": EncoderProfile("balanced", speed=2, quality="good", analysis_speed=4, tile_columns=1,
+                               lag_in_frames=25, auto_alt_ref=1),
+    # the settings used before profiles existed: slowest, best quality per byte
+    "archival": EncoderProfile("archival"),
+}
+DEFAULT_PROFILE = "archival"
+
+
+def profile_names() -> List[str]:
+    """
+    Names accepted by `get_profile`, "tuned" only once `tuning` has saved one.
+    """
+    names = list(PROFILES)
+    if (data_dir() / TUNED_FILE).exists():
+        names.append(TUNED)
+    return names
+
+
+def get_profile(profile: Union[str, EncoderProfile, None] = None) -> EncoderProfile:
+    """
+    Looks a profile up by name: one of PROFILES, or "tuned" for the one
+    `tuning` picked on this machine. None gives DEFAULT_PROFILE, a
+    profile object is returned as is.
+    """
+    if isinstance(profile, EncoderProfile):
+        return profile
+    name = profile or DEFAULT_PROFILE
+    if name == TUNED:
+        path = data_dir() / TUNED_FILE
+        if not path.exists():
+            raise ValueError("No tuned encoder profile on this machine yet, run sticker-tune first")
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        known = {f.name for f in fields(EncoderProfile)}
+        return EncoderProfile(**{k: v for k, v in data.items() if k in known})
+    if name not in PROFILES:
+        raise ValueError(f"Unknown encoder profile: {name}. Use one of {', '.join(PROFILES)} or {TUNED}")
+    return PROFILES[name]
+
+
+def save_tuned(profile: EncoderProfile, **extra) -> None:
+    """
+    Saves `profile` as this machine's "tuned" profile, `extra` (e.g. the measurements) alongside.
+    """
+    data = dict(profile.to_dict(), name=TUNED, **extra)
+    with open(data_dir() / TUNED_FILE, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1)
@@ -0,0 +1,143 @@
+import json
+import subprocess
+import sys
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, IO, Iterator
+
+from . import cancel
+from .process import popen, reap
+
+
+@dataclass(slots=True)
+class ProgressEvent:
+    """
+    Progress of one ffmpeg run, parsed from its `-progress` output.
+
+    :param stage: what is running: "mezzanine", "analysis", "encode" or "proxy"
+    :param iteration: number of the trial encode (0 outside the search)
+    :param frame: frames processed so far
+    :param total_frames: frames of the whole clip, 0 if unknown
+    :param fps: processing speed in frames per second
+    :param out_time: position in the output, seconds
+    :param total_size: bytes written so far
+    :param speed: processing speed relative to realtime
+    :param done: True for the last event of the run
+    """
+    stage: str
+    iteration: int = 0
+    frame: int = 0
+    total_frames: int = 0
+    fps: float = 0.0
+    out_time: float = 0.0
+    total_size: int = 0
+    speed: float = 0.0
+    done: bool = False
+
+    @classmethod
+    def from_block(cls, block: Dict[str, str], stage: str, iteration: int = 0, total_frames: int = 0):
+        def number(key, convert=float):
+            try:
+                return convert(block.get(key, "0").rstrip("x"))
+            except ValueError:
+                return convert(0)
+
+        return cls(stage, iteration, number("frame", int), total_frames, number("fps"),
+                   number("out_time_us", int) / 1e6, number("total_size", int), number("speed"),
+                   block.get("progress") == "end")
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def reporter(callback: Callable[[ProgressEvent], None], stage: str, iteration: int = 0, total_frames: int = 0,
+             guard: Callable[[Dict[str, str]], bool] = None):
+    """
+    Builds an `on_progress` callback for `run_with_progress` that turns every
+    block into a ProgressEvent for `callback` and then asks `guard` (if any)
+    whether to stop the process.
+    """
+    def on_progress(block):
+        if callback:
+            callback(ProgressEvent.from_block(block, stage, iteration, total_frames))
+        return bool(guard and guard(block))
+    return on_progress
+
+
+class ProgressPrinter:
+    """
+    Event callback printing progress to stderr, either as a live status line
+    ("line") or as JSON lines ("json"). Picklable, so it can be handed to
+    worker processes.
+
+    :param mode: "line" or "json"
+    :param label: name of the job, usually the input file
+    """
+
+    def __init__(self, mode: str = "line", label: str = ""):
+        self.mode = mode
+        self.label = label
+
+    def __call__(self, event: ProgressEvent):
+        if self.mode == "json":
+            sys.stderr.write(json.dumps(dict(file=self.label, **event.to_dict())) + "\n")
+        else:
+            total = f"/{event.total_frames}" if event.total_frames else ""
+            iteration = f" #{event.iteration}" if event.iteration else ""
+            sys.stderr.write(f"\r{self.label} {event.stage}{iteration}: frame {event.frame}{total}, "
+                             f"{event.fps:.1f} fps, {event.total_size / 1024:.1f} kb, {event.speed:.2f}x\033[K")
+            if event.done:
+                sys.stderr.write("\n")
+        sys.stderr.flush()
+
+
+def read_progress(stream: IO[str]) -> Iterator[Dict[str, str]]:
+    """
+    Parses the output of ffmpeg's `-progress` option: blocks of key=value
+    lines, each terminated by a `progress=continue` or `progress=end` line.
+
+    :param stream: text stream ffmpeg writes the progress to
+    :return: one dict per block
+    """
+    block = {}
+    for line in stream:
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            continue
+        block[key] = value
+        if key == "progress":
+            yield block
+            block = {}
+
+
+def run_with_progress(cmd, on_progress: Callable[[Dict[str, str]], bool] = None) -> bool:
+    """
+    Runs an ffmpeg command with `-progress pipe:1` and passes every progress
+    block to `on_progress`. If the callback returns True the process is
+    killed.
+
+    :param cmd: ffmpeg command line
+    :param on_progress: callback receiving the progress blocks
+    :return: True if ffmpeg ran to completion, False if it was stopped by the callback
+    """
+    cmd = [cmd[0], '-progress', 'pipe:1', '-nostats'] + list(cmd[1:])
+    process = popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    stopped = False
+    try:
+        for block in read_progress(process.stdout):
+            if on_progress and on_progress(block):
+                stopped = True
+                process.kill()
+                break
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        process.stdout.close()
+        returncode = reap(process)
+        token = cancel.current()
+        if token is not None:
+            token.detach(process)
+            token.check()
+    if not stopped and returncode:
+        raise subprocess.CalledProcessError(returncode, cmd)
+    return not stopped
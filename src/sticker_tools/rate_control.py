@@ -0,0 +1,287 @@
+import logging
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Generator, List, Optional, Tuple
+
+from . import trace
+
+logging.basicConfig(level=logging.INFO)
+
+
+@dataclass(slots=True)
+class Sample:
+    """
+    One measured point of the size-vs-bitrate curve of a clip.
+    `partial` samples come from encodes stopped early, their size is extrapolated.
+    `seconds` is the wall time of the trial encode, if it was measured.
+    """
+    bitrate: float
+    size_kb: float
+    partial: bool = False
+    seconds: float = 0.0
+
+
+class Overshoot(Exception):
+    """
+    Raised by an encode callable that stopped a trial encode early because
+    it would clearly end over the target size.
+
+    :param projected_kb: size extrapolated from the part that was encoded
+    """
+
+    def __init__(self, projected_kb: float):
+        super().__init__(f"Projected size {projected_kb:.2f} kb exceeds the target")
+        self.projected_kb = projected_kb
+
+
+@dataclass(slots=True)
+class SearchResult:
+    """
+    Outcome of a bitrate search. The result is the chosen trial encode: the
+    largest complete one under the target, or, if every complete one is over
+    it, the smallest.
+
+    :param bitrate: bitrate of the chosen encode, bps
+    :param size_kb: size of the chosen encode in KB
+    :param encodes: number of trial encodes used by the search
+    :param converged: True if the chosen encode is inside the accuracy window
+    :param samples: every (bitrate, size) point measured, in order
+    :param stopped: "cancelled" or "timeout" if the search was cut short and the result is the best encode so far
+    :param chosen: index of the chosen encode in `samples`, None if every encode was aborted early
+    """
+    bitrate: float
+    size_kb: float
+    encodes: int
+    converged: bool
+    samples: List[Sample] = field(default_factory=list)
+    stopped: str = None
+    chosen: int = None
+
+    def history(self) -> List[dict]:
+        """
+        One record per trial encode: iteration, bitrate, size, whether it was
+        aborted, its wall time and whether it's the chosen one.
+        """
+        return [dict(iteration=i + 1, bitrate=s.bitrate, size_kb=s.size_kb, partial=s.partial,
+                     seconds=s.seconds, chosen=i == self.chosen)
+                for i, s in enumerate(self.samples)]
+
+    def settle(self, sample: Sample, target_size_kb: float, accuracy_kb: float) -> None:
+        """
+        Adds the final encode made after a search whose every trial was
+        aborted (see `fallback_bitrate`) and makes it the result.
+        """
+        self.samples.append(sample)
+        self.chosen = len(self.samples) - 1
+        self.bitrate, self.size_kb = sample.bitrate, sample.size_kb
+        self.encodes = len(self.samples)
+        self.converged = in_window(sample.size_kb, target_size_kb, accuracy_kb)
+
+
+def in_window(size_kb: float, target_size_kb: float, accuracy_kb: float) -> bool:
+    """
+    True if the size is under the target by less than `accuracy_kb`.
+    """
+    return 0 < (target_size_kb - size_kb) < accuracy_kb
+
+
+def _bracket(samples: List[Sample], target_size_kb: float):
+    """
+    Returns the highest under-target sample and the lowest over-target sample (either may be None).
+
+    Partial samples are soft upper bounds: their size is extrapolated, so
+    one is dropped once a complete encode at the same or a higher bitrate
+    came out under the target.
+    """
+    under = [s for s in samples if s.size_kb < target_size_kb]
+    fits = max((s.bitrate for s in under if not s.partial), default=None)
+    over = [s for s in samples if s.size_kb >= target_size_kb
+            and not (s.partial and fits is not None and s.bitrate <= fits)]
+    low = max(under, key=lambda s: s.bitrate) if under else None
+    high = min(over, key=lambda s: s.bitrate) if over else None
+    return low, high
+
+
+def choose(samples: List[Sample], target_size_kb: float) -> Optional[int]:
+    """
+    Index of the trial encode to keep: the largest complete one under the
+    target; failing that the smallest complete one; None if every encode was
+    aborted early and none of them left a usable file.
+    """
+    complete = [i for i, s in enumerate(samples) if not s.partial]
+    under = [i for i in complete if samples[i].size_kb < target_size_kb]
+    if under:
+        return max(under, key=lambda i: samples[i].size_kb)
+    if complete:
+        return min(complete, key=lambda i: samples[i].size_kb)
+    return None
+
+
+def fallback_bitrate(samples: List[Sample], target_size_kb: float, accuracy_kb: float) -> float:
+    """
+    Bitrate of the final encode when every trial was aborted over the target:
+    the lowest bitrate tried, scaled down by the ratio of the middle of the
+    accuracy window to its projected size. The projection is only an
+    estimate (a soft bound), so the final encode runs without the guard and
+    is judged by its real size (see `SearchResult.settle`).
+    """
+    aim = target_size_kb - accuracy_kb / 2
+    lowest = min(samples, key=lambda s: s.bitrate)
+    return lowest.bitrate * min(1.0, aim / lowest.size_kb)
+
+
+def bisect_strategy(samples: List[Sample], target_size_kb: float, accuracy_kb: float) -> Optional[float]:
+    """
+    Plain bisection of the bitrate bracket. Until the target is bracketed
+    the bitrate is scaled by the ratio of the target to the measured size.
+    """
+    low, high = _bracket(samples, target_size_kb)
+    if low and high:
+        return (low.bitrate + high.bitrate) / 2
+    last = samples[-1]
+    return last.bitrate * target_size_kb / last.size_kb
+
+
+def model_strategy(samples: List[Sample], target_size_kb: float, accuracy_kb: float) -> Optional[float]:
+    """
+    Fits log(size) = a + k * log(bitrate) through the two most relevant samples
+    (the bracket around the target if there is one, the two closest to it otherwise)
+    and solves it for the middle of the accuracy window. With a single sample the
+    size is assumed to be proportional to the bitrate.
+
+    The guess is safeguarded: inside a bracket it must fall in the inner 90% of it
+    (bisection is used otherwise), outside a bracket one step may change the
+    bitrate at most 4x.
+
+    Returns None if the encoder has saturated, i.e. the file stays under the
+    target no matter how much the bitrate grows.
+    """
+    aim = target_size_kb - accuracy_kb / 2
+    low, high = _bracket(samples, target_size_kb)
+    if low and high:
+        points = [low, high]
+    else:
+        points = sorted(samples, key=lambda s: abs(math.log(s.size_kb / aim)))[:2]
+
+    slope = 1.0
+    anchor = points[0]
+    if len(points) == 2:
+        a, b = points
+        if a.bitrate != b.bitrate and a.size_kb > 0 and b.size_kb > 0:
+            slope = math.log(b.size_kb / a.size_kb) / math.log(b.bitrate / a.bitrate)
+
+    if slope < 0.05:
+        if high is None:
+            # size doesn't react to the bitrate anymore, more bits won't be used
+            return None
+        # noisy, non-monotonic measurement: fall back to a proportional step
+        slope = 1.0
+
+    guess = anchor.bitrate * math.exp(math.log(aim / anchor.size_kb) / slope)
+
+    if low and high:
+        span = high.bitrate - low.bitrate
+        if not (low.bitrate + 0.05 * span <= guess <= high.bitrate - 0.05 * span):
+            guess = (low.bitrate + high.bitrate) / 2
+    elif low:
+        guess = min(max(guess, low.bitrate * 1.02), low.bitrate * 4)
+    elif high:
+        guess = max(min(guess, high.bitrate * 0.98), high.bitrate / 4)
+    return guess
+
+
+STRATEGIES = {
+    "model": model_strategy,
+    "bisect": bisect_strategy,
+}
+
+
+def searcher(seed_bitrate: float, target_size_kb: float = 255, accuracy_kb: float = 5, strategy="model",
+             max_encodes: int = 10) -> Generator[Tuple[int, float], Sample, SearchResult]:
+    """
+    The search loop without the encoding: a generator that yields
+    (iteration, bitrate) of the next trial encode and expects the measured
+    Sample to be sent back. Its return value (StopIteration.value) is the
+    SearchResult. `search` drives it with a blocking encode callable,
+    `aio.convert_async` with a coroutine.
+
+    See `search` for the parameters.
+    """
+    logger = logging.getLogger("rate_control")
+    if not callable(strategy):
+        strategy = STRATEGIES[strategy]
+
+    samples = []
+    bitrate = seed_bitrate
+    for iteration in range(1, max_encodes + 1):
+        logger.info(f"Encoding with bitrate {bitrate / 1000:.2f} kbps. Iteration {iteration} / {max_encodes}")
+        sample = yield iteration, bitrate
+        samples.append(sample)
+        size_kb = sample.size_kb
+        if sample.partial:
+            logger.info(f"Aborted the encode, projected file size: {size_kb:.2f} kb")
+        else:
+            logger.info(f"Encoded file size: {size_kb:.2f} kb")
+        trace.event("iteration", iteration=iteration, bitrate=bitrate, size_kb=size_kb,
+                    partial=samples[-1].partial)
+
+        if in_window(size_kb, target_size_kb, accuracy_kb):
+            logger.info(f"{target_size_kb - accuracy_kb} kb < [{size_kb:.2f} kb] < {target_size_kb} kb")
+            break
+        if size_kb >= target_size_kb:
+            logger.info(f"Exceeded target file size with {size_kb:.2f} kb at {bitrate / 1000:.2f} kbps")
+
+        next_bitrate = strategy(samples, target_size_kb, accuracy_kb)
+        if next_bitrate is None:
+            logger.info("File size doesn't grow with the bitrate anymore, stopping")
+            break
+        if any(abs(next_bitrate - s.bitrate) <= 0.005 * s.bitrate for s in samples):
+            logger.info(f"Bitrate {next_bitrate / 1000:.2f} kbps was already tried, stopping")
+            break
+        bitrate = next_bitrate
+
+    chosen = choose(samples, target_size_kb)
+    result = samples[chosen] if chosen is not None else samples[-1]
+    converged = in_window(result.size_kb, target_size_kb, accuracy_kb)
+    logger.info(f"Search finished after {len(samples)} encodes")
+    if chosen is not None and chosen != len(samples) - 1:
+        logger.info(f"Keeping encode {chosen + 1}: {result.size_kb:.2f} kb at {result.bitrate / 1000:.2f} kbps")
+    return SearchResult(result.bitrate, result.size_kb, len(samples), converged, samples, chosen=chosen)
+
+
+def search(encode: Callable[[float], float], seed_bitrate: float, target_size_kb: float = 255,
+           accuracy_kb: float = 5, strategy="model", max_encodes: int = 10,
+           progress_callback=None, sample_callback: Callable[[Sample], None] = None) -> SearchResult:
+    """
+    Searches for the bitrate that yields a file just under target_size_kb.
+
+    :param encode: callable that encodes the clip with the given bitrate (bps) and returns the size in KB;
+        it may raise Overshoot to report an encode aborted over the target, which then counts as an upper bound.
+        Every encode should leave its own file, the result may point to any of them (`SearchResult.chosen`)
+    :param seed_bitrate: bitrate of the first trial encode
+    :param target_size_kb: upper limit of the output size
+    :param accuracy_kb: the search stops once the size is under the target by less than this
+    :param strategy: name from STRATEGIES or a callable (samples, target_size_kb, accuracy_kb) -> bitrate or None
+    :param max_encodes: hard limit of trial encodes
+    :param progress_callback: called with the number of the encode about to start
+    :param sample_callback: called with the Sample of every finished (or aborted) encode
+    :return: SearchResult
+    """
+    steps = searcher(seed_bitrate, target_size_kb, accuracy_kb, strategy, max_encodes)
+    try:
+        iteration, bitrate = next(steps)
+        while True:
+            if progress_callback:
+                progress_callback(iteration)
+            started = time.perf_counter()
+            try:
+                sample = Sample(bitrate, encode(bitrate))
+            except Overshoot as e:
+                sample = Sample(bitrate, e.projected_kb, partial=True)
+            sample.seconds = time.perf_counter() - started
+            if sample_callback:
+                sample_callback(sample)
+            iteration, bitrate = steps.send(sample)
+    except StopIteration as stop:
+        return stop.value
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+from .convert_optimize import ffmpeg_version, get_scalecrop_filter, vp9_command
+from .scratch import atomic_copy
+from .storage import data_dir, file_digest
+
+logging.basicConfig(level=logging.INFO)
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class ResultCache:
+    """
+    Content-addressed on-disk cache of finished (converted and patched) stickers.
+
+    Entries are keyed by the hash of the input file plus every parameter that
+    influences the output: search settings, filter chain, encoder flags and
+    the ffmpeg version. Each entry is a `<key>.webm` with a `<key>.json`
+    holding its metadata. The cache is bounded by size and evicts the least
+    recently used entries; a hit refreshes the entry's modification time.
+    """
+
+    def __init__(self, directory: str = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = Path(directory) if directory else data_dir() / "results"
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(input_path: str, **params) -> str:
+        """
+        Cache key of converting `input_path` with the given parameters.
+
+        :param input_path: source video
+        :param params: JSON-serializable parameters of the conversion (target_size_kb, accuracy_kb, ...)
+        """
+        fingerprint = {
+            "input": file_digest(input_path),
+            "params": params,
+            "filters": get_scalecrop_filter(input_path),
+            "encoder": vp9_command(2, "<input>", "<output>", "<bitrate>", profile=params.get("profile")),
+            "ffmpeg": ffmpeg_version(),
+        }
+        return hashlib.sha256(json.dumps(fingerprint, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _paths(self, key: str):
+        return self.directory / f"{key}.webm", self.directory / f"{key}.json"
+
+    def get(self, key: str, destination: str):
+        """
+        Copies the cached sticker to `destination`.
+
+        :return: the stored metadata on a hit, None on a miss
+        """
+        logger = logging.getLogger("result_cache")
+        webm, meta = self._paths(key)
+        try:
+            with open(meta, "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+            atomic_copy(webm, destination)
+            os.utime(webm)
+        except (OSError, ValueError):
+            return None
+        logger.info(f"Cache hit for {destination}")
+        return metadata
+
+    def put(self, key: str, source: str, metadata: dict = None) -> None:
+        """
+        Stores a finished sticker and evicts old entries if the cache grew over its limit.
+        """
+        webm, meta = self._paths(key)
+        atomic_copy(source, webm)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(metadata or {}, f)
+        os.replace(tmp, meta)
+        self.prune()
+
+    def prune(self, max_bytes: int = None) -> int:
+        """
+        Removes least recently used entries until the cache fits in `max_bytes`.
+
+        :param max_bytes: size limit, defaults to the cache's own limit; 0 empties the cache
+        :return: number of removed entries
+        """
+        logger = logging.getLogger("result_cache")
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        entries = []
+        for webm in self.directory.glob("*.webm"):
+            try:
+                stat = webm.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, webm))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, webm in sorted(entries):
+            if total <= limit:
+                break
+            for path in (webm, webm.with_suffix(".json")):
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+            total -= size
+            removed += 1
+        if removed:
+            logger.info(f"Evicted {removed} cached stickers, {total / 1024 / 1024:.1f} MB left")
+        return removed
+
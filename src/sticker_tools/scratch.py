@@ -0,0 +1,113 @@
+import logging
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from . import trace
+
+logging.basicConfig(level=logging.INFO)
+
+SCRATCH_SUFFIX = ".sticker-tmp"
+
+# where trial encodes go: "disk" next to the output, "ram" on a RAM-backed file system
+SINKS = ("disk", "ram")
+# free space the RAM-backed file system keeps on top of a job's scratch, for the jobs starting next to it
+RAM_HEADROOM = 32 * 1024 * 1024
+
+
+def ram_dir() -> str:
+    """
+    RAM-backed directory for scratch files: $STICKER_TOOLS_RAMDIR if set,
+    /dev/shm where available, the system temp directory otherwise
+    (on Windows that's at least a local disk, not a network share).
+    """
+    override = os.environ.get("STICKER_TOOLS_RAMDIR")
+    if override:
+        return override
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+def scratch_root(sink: str = "ram", needed_bytes: int = 0):
+    """
+    Directory to create job scratch directories in for the given encode sink,
+    None for "disk" (next to the output).
+
+    RAM-backed file systems are often small (64 MB /dev/shm in containers)
+    and shared by every worker of a batch, so with "ram" the directory is
+    only used if it has `needed_bytes` (see `convert_optimize.scratch_size`)
+    plus `RAM_HEADROOM` free; otherwise the job falls back to disk.
+    """
+    if sink not in SINKS:
+        raise ValueError(f"Unknown encode sink: {sink}. Use one of {', '.join(SINKS)}")
+    if sink == "disk":
+        return None
+    directory = ram_dir()
+    free = shutil.disk_usage(directory).free
+    if free < needed_bytes + RAM_HEADROOM:
+        logging.getLogger("cleanup").info(f"Only {free / 2 ** 20:.0f} MB free in {directory}, "
+                                          f"keeping the scratch files on disk")
+        return None
+    return directory
+
+
+@contextmanager
+def job_scratch(output_path: str, root: str = None):
+    """
+    Private scratch directory of one conversion job. Passlogs and trial
+    encodes live there, so concurrent jobs (even in the same folder) never
+    see each other's files. The directory is removed with everything in it
+    when the job ends, successfully or not.
+
+    :param output_path: final output of the job, the scratch directory is created next to it
+        so the accepted encode can be moved into place with an atomic rename
+    :param root: create the scratch directory here instead
+    """
+    logger = logging.getLogger("cleanup")
+    directory = root or os.path.dirname(os.path.abspath(output_path))
+    stem = os.path.splitext(os.path.basename(output_path))[0]
+    path = tempfile.mkdtemp(prefix=f".{stem}.", suffix=SCRATCH_SUFFIX, dir=directory)
+    try:
+        yield path
+    finally:
+        logger.info(f"Removing scratch directory {path}")
+        with trace.span("cleanup", directory=path):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def atomic_copy(source: str, destination: str) -> None:
+    """
+    Copies `source` next to `destination` and renames it into place, so
+    readers never see a partially written destination.
+    """
+    directory = os.path.dirname(os.path.abspath(destination))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".", suffix=SCRATCH_SUFFIX)
+    os.close(fd)
+    try:
+        shutil.copyfile(source, tmp)
+        os.replace(tmp, destination)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def promote(source: str, destination: str) -> None:
+    """
+    Moves a finished file into its final place. The destination is replaced
+    atomically: readers see either the old file or the complete new one.
+    If the source is on another file system it is first copied next to the
+    destination and then renamed.
+    """
+    try:
+        os.replace(source, destination)
+        return
+    except OSError:
+        if not os.path.exists(source):
+            raise
+    atomic_copy(source, destination)
+    os.remove(source)
@@ -0,0 +1,160 @@
+import logging
+import os
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+from .convert_optimize import vp9_pass1, vp9_pass2
+from .probe import MediaInfo
+from .process import run
+from . import trace
+
+logging.basicConfig(level=logging.INFO)
+
+# chunks shorter than this don't give libvpx's rate control enough room
+MIN_SEGMENT_SECONDS = 2.0
+
+
+def plan_segments(info: MediaInfo, segments: int, min_seconds: float = MIN_SEGMENT_SECONDS) -> List[Tuple[int, int]]:
+    """
+    Splits the frames of a clip into up to `segments` equal chunks no shorter than `min_seconds`.
+
+    :return: list of (first frame, end frame) pairs, end exclusive
+    """
+    if not info.frames or not info.fps:
+        return [(0, info.frames)]
+    count = max(1, min(segments, int(info.duration // min_seconds)))
+    bounds = [round(i * info.frames / count) for i in range(count + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(count)]
+
+
+def frame_complexity(source: str, directory: str) -> List[int]:
+    """
+    Shared complexity analysis: a single fast constant-quality realtime VP9
+    encode of the whole clip; the size of each frame's packet measures how
+    many bits the frame needs (spatial and temporal detail alike).
+
+    :return: packet size in bytes of every frame
+    """
+    analysis_path = os.path.join(directory, "complexity.webm")
+    with trace.span("complexity", input=source):
+        run([
+            'ffmpeg', '-v', 'quiet', '-hide_banner', '-threads', '0',
+            '-i', source, '-map', 'v:0', '-an',
+            '-c:v', 'libvpx-vp9', '-quality', 'realtime', '-speed', '8', '-crf', '40', '-b:v', '0',
+            '-y', analysis_path
+        ])
+        result = run(['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=size',
+                      '-of', 'csv=p=0', analysis_path], capture_output=True, text=True)
+    os.remove(analysis_path)
+    return [int(line) for line in result.stdout.split() if line.strip().isdigit()]
+
+
+class SegmentedEncoder:
+    """
+    Encodes a prepared clip (the lossless intermediate of `prepare_mezzanine`)
+    as keyframe-aligned chunks in parallel processes and losslessly joins them
+    into one WebM.
+
+    Every chunk gets the share of the bit budget its frames have in the shared
+    complexity analysis, so a search over the overall bitrate works exactly as
+    with a single encode. The first pass of every chunk runs once in `prepare`,
+    each `encode` runs only the second passes and the concatenation.
+
+    :param source: intra-only intermediate, so any frame is a valid cut point
+    :param info: MediaInfo of the intermediate
+    :param directory: scratch directory of the job
+    :param segments: number of chunks (fewer for short clips)
+    :param threads: encoder threads per chunk, 0 splits the cores between the chunks
+    :param options: extra `vp9_command` options (speed, quality, ...)
+    """
+
+    def __init__(self, source: str, info: MediaInfo, directory: str, segments: int, threads: int = 0, **options):
+        self.source = source
+        self.info = info
+        self.directory = os.path.join(directory, "segments")
+        os.makedirs(self.directory, exist_ok=True)
+        self.plan = plan_segments(info, segments)
+        self.threads = threads or max(1, (os.cpu_count() or 1) // len(self.plan))
+        self.options = options
+        self.chunks = []
+        self.weights = []
+
+    def __len__(self):
+        return len(self.plan)
+
+    def _chunk(self, index: int) -> str:
+        return os.path.join(self.directory, f"chunk{index:03d}.mkv")
+
+    def _map(self, func, items):
+        # every chunk runs in a copy of the caller's context, so it's traced with the job
+        calls = [(copy_context(), item) for item in items]
+        with ThreadPoolExecutor(max_workers=len(self.plan)) as pool:
+            return list(pool.map(lambda call: call[0].run(func, call[1]), calls))
+
+    def _output(self, index: int) -> str:
+        return os.path.join(self.directory, f"chunk{index:03d}.webm")
+
+    def _passlog(self, index: int) -> str:
+        return os.path.join(self.directory, f"chunk{index:03d}")
+
+    def prepare(self, vid_bps: float) -> None:
+        """
+        Cuts the intermediate into chunks, runs the complexity analysis and
+        the first pass of every chunk.
+
+        :param vid_bps: nominal bitrate of the first passes
+        """
+        logger = logging.getLogger("segments")
+        cuts = ",".join(str(start) for start, _ in self.plan[1:])
+        cmd = ['ffmpeg', '-v', 'quiet', '-hide_banner', '-i', self.source, '-map', 'v:0', '-c', 'copy',
+               '-f', 'segment', '-segment_format', 'matroska', '-reset_timestamps', '1']
+        if cuts:
+            cmd += ['-segment_frames', cuts]
+        cmd += ['-y', os.path.join(self.directory, "chunk%03d.mkv")]
+        with trace.span("split", segments=len(self.plan)):
+            run(cmd)
+        self.chunks = [self._chunk(i) for i in range(len(self.plan))]
+
+        sizes = frame_complexity(self.source, self.directory)
+        totals = [sum(sizes[start:end]) for start, end in self.plan]
+        if not sizes or not sum(totals):
+            # fall back to splitting the budget by duration
+            totals = [end - start for start, end in self.plan]
+        self.weights = [t / sum(totals) for t in totals]
+        logger.info(f"Encoding in {len(self.plan)} segments, bit budget shares: "
+                    + ", ".join(f"{w:.1%}" for w in self.weights))
+
+        rates = self.bitrates(vid_bps)
+        self._map(lambda i: vp9_pass1(self.chunks[i], self._output(i), rates[i], passlogfile=self._passlog(i),
+                                      threads=self.threads, **self.options),
+                  range(len(self.plan)))
+
+    def bitrates(self, vid_bps: float) -> List[float]:
+        """
+        Bitrate of every chunk so that the chunks together spend `vid_bps` over the whole clip.
+        """
+        total_bits = vid_bps * self.info.duration
+        total_frames = self.info.frames or 1
+        rates = []
+        for (start, end), weight in zip(self.plan, self.weights):
+            seconds = self.info.duration * (end - start) / total_frames
+            rates.append(total_bits * weight / seconds if seconds else vid_bps)
+        return rates
+
+    def encode(self, vid_bps: float, output_path: str) -> None:
+        """
+        Encodes all chunks in parallel at their share of `vid_bps` and joins them into `output_path`.
+        """
+        rates = self.bitrates(vid_bps)
+        self._map(lambda i: vp9_pass2(self.chunks[i], self._output(i), rates[i], passlogfile=self._passlog(i),
+                                      threads=self.threads, **self.options),
+                  range(len(self.plan)))
+        concat_list = os.path.join(self.directory, "concat.txt")
+        with open(concat_list, "w", encoding="utf-8") as f:
+            for i in range(len(self.plan)):
+                path = self._output(i).replace("'", "'\\''")
+                f.write(f"file '{path}'\n")
+        with trace.span("concat", segments=len(self.plan)):
+            run(['ffmpeg', '-v', 'quiet', '-hide_banner', '-f', 'concat', '-safe', '0', '-i', concat_list,
+                 '-c', 'copy', '-y', output_path])
@@ -0,0 +1,287 @@
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from typing import Iterator, List, Optional
+
+from .cancel import Cancelled, CancelToken
+from .pipeline import JobResult, make_sticker
+from .scratch import SCRATCH_SUFFIX
+
+logging.basicConfig(level=logging.INFO)
+
+# job states, one subdirectory of the spool each
+STATES = ("incoming", "active", "done", "failed")
+# separates the job name from the worker id in the name of a lease
+LEASE_SEP = "~"
+
+DEFAULT_HEARTBEAT = 10.0
+DEFAULT_STALE_AFTER = 120.0
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+def init_spool(spool: str) -> None:
+    for state in STATES:
+        os.makedirs(os.path.join(spool, state), exist_ok=True)
+
+
+def _write_json(path: str, data: dict) -> None:
+    # written next to the destination and renamed into place, so no reader sees half a file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=SCRATCH_SUFFIX)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def submit(spool: str, input_path: str, **options) -> str:
+    """
+    Queues `input_path` for the workers of `spool`.
+
+    The input (and the output next to it) must be reachable under the same
+    path on every machine running a worker.
+
+    :param options: JSON-serializable `make_sticker` options of the job
+        (target_size_kb, accuracy_kb, calibrate, segments, timeout, ...)
+    :return: job name
+    """
+    init_spool(spool)
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    # names sort in submission order
+    name = f"{time.time_ns():020d}-{stem}"
+    job = dict(name=name, input=os.path.abspath(input_path), options=options, attempts=0)
+    _write_json(os.path.join(spool, "incoming", name + ".json"), job)
+    return name
+
+
+def _job_name(lease: str) -> str:
+    return lease.rsplit(LEASE_SEP, 1)[0]
+
+
+class Lease:
+    """
+    A job claimed by one worker: the job file renamed into active/ under a
+    name carrying the worker id. Renames are atomic, so of several workers
+    renaming the same job only one succeeds. The owner keeps touching the
+    lease file (`heartbeat`); a lease not touched for `stale_after` seconds
+    is taken back by `recover_stale`, and its owner finds out at its next
+    heartbeat.
+    """
+
+    def __init__(self, spool: str, path: str, job: dict):
+        self.spool = spool
+        self.path = path
+        self.job = job
+
+    @property
+    def name(self) -> str:
+        return self.job["name"]
+
+    def heartbeat(self) -> bool:
+        """
+        Renews the lease, False if it was lost to `recover_stale`.
+        """
+        try:
+            os.utime(self.path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def finish(self, state: str, result: dict) -> None:
+        """
+        Writes the result next to the job in done/ or failed/ and moves the job there.
+        """
+        directory = os.path.join(self.spool, state)
+        _write_json(os.path.join(directory, self.name + ".result.json"), result)
+        os.replace(self.path, os.path.join(directory, self.name + ".json"))
+
+    def release(self) -> None:
+        """
+        Puts the job back into incoming/ for another worker, e.g. on shutdown.
+        """
+        try:
+            os.replace(self.path, os.path.join(self.spool, "incoming", self.name + ".json"))
+        except FileNotFoundError:
+            pass
+
+
+def claim(spool: str, worker: str = None) -> Optional[Lease]:
+    """
+    Claims the oldest job of incoming/, None if there is none.
+    """
+    worker = worker or worker_id()
+    incoming = os.path.join(spool, "incoming")
+    for entry in sorted(os.listdir(incoming)):
+        if not entry.endswith(".json") or entry.startswith("."):
+            continue
+        name = entry[:-len(".json")]
+        source = os.path.join(incoming, entry)
+        path = os.path.join(spool, "active", f"{name}{LEASE_SEP}{worker}.json")
+        try:
+            # a rename keeps the mtime of the queued job, so touch it first or
+            # `recover_stale` would take the new lease for a stale one
+            os.utime(source)
+            os.rename(source, path)
+            with open(path, encoding="utf-8") as f:
+                job = json.load(f)
+        except FileNotFoundError:
+            # another worker was faster
+            continue
+        job["attempts"] = job.get("attempts", 0) + 1
+        job["worker"] = worker
+        _write_json(path, job)
+        return Lease(spool, path, job)
+    return None
+
+
+def recover_stale(spool: str, stale_after: float = DEFAULT_STALE_AFTER,
+                  max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> List[str]:
+    """
+    Takes back the leases whose owner stopped heartbeating (crashed or lost
+    its machine): the job goes back to incoming/, or to failed/ once it used
+    up `max_attempts`, so a clip that kills its workers can't block the spool.
+
+    Staleness is judged by the lease's mtime against this machine's clock,
+    so `stale_after` should be well above the clock skew between machines.
+
+    :return: names of the recovered jobs
+    """
+    logger = logging.getLogger("spool")
+    active = os.path.join(spool, "active")
+    recovered = []
+    now = time.time()
+    for entry in sorted(os.listdir(active)):
+        if not entry.endswith(".json") or entry.startswith("."):
+            continue
+        path = os.path.join(active, entry)
+        try:
+            if now - os.stat(path).st_mtime < stale_after:
+                continue
+            with open(path, encoding="utf-8") as f:
+                job = json.load(f)
+        except (FileNotFoundError, ValueError):
+            continue
+        name = _job_name(entry[:-len(".json")])
+        if job.get("attempts", 0) >= max_attempts:
+            state, destination = "failed", os.path.join(spool, "failed", name + ".json")
+        else:
+            state, destination = "incoming", os.path.join(spool, "incoming", name + ".json")
+        try:
+            # only one of the workers recovering the same lease wins the rename
+            os.rename(path, destination)
+        except FileNotFoundError:
+            continue
+        if state == "failed":
+            _write_json(os.path.join(spool, "failed", name + ".result.json"),
+                        dict(status="error", error=f"gave up after {job.get('attempts')} attempts, "
+                                                    f"last worker {job.get('worker')} stopped responding"))
+        logger.info(f"Recovered stale job {name} of {job.get('worker')} into {state}")
+        recovered.append(name)
+    return recovered
+
+
+def _heartbeat(lease: Lease, token: CancelToken, interval: float, stop: threading.Event) -> None:
+    logger = logging.getLogger("spool")
+    while not stop.wait(interval):
+        if not lease.heartbeat():
+            logger.info(f"Lost the lease of {lease.name}, stopping it")
+            token.cancel("lost")
+            return
+
+
+def run_job(lease: Lease, heartbeat: float = DEFAULT_HEARTBEAT, **options) -> Optional[JobResult]:
+    """
+    Runs one claimed job through `make_sticker` while heartbeating its lease,
+    and files the result with the worker's metrics next to the job.
+
+    :param options: worker-side `make_sticker` options (threads, cache, ...), they override the job's
+    :return: JobResult, None if the lease was lost and the job belongs to another worker now
+    """
+    logger = logging.getLogger("spool")
+    job = lease.job
+    token = CancelToken()
+    stop = threading.Event()
+    beat = threading.Thread(target=_heartbeat, args=(lease, token, heartbeat, stop), daemon=True)
+    beat.start()
+    claimed = time.time()
+    logger.info(f"Running {lease.name}: {job['input']} (attempt {job['attempts']})")
+    try:
+        result = make_sticker(job["input"], cancel=token, **dict(job.get("options", {}), **options))
+    except Cancelled as e:
+        if e.reason == "lost":
+            return None
+        result = JobResult(job["input"], os.path.splitext(job["input"])[0] + ".webm", status=e.reason,
+                           error=str(e))
+    except Exception as e:
+        result = JobResult(job["input"], os.path.splitext(job["input"])[0] + ".webm", status="error",
+                           error=str(e))
+    finally:
+        stop.set()
+        beat.join()
+    if token.reason == "lost":
+        return None
+    result.seconds = result.seconds or time.time() - claimed
+    metrics = dict(worker=job["worker"], attempts=job["attempts"], claimed=claimed, finished=time.time())
+    state = "failed" if result.size_kb is None or result.status == "over_target" else "done"
+    lease.finish(state, dict(result.to_dict(), **metrics))
+    logger.info(f"Finished {lease.name}: {result.status}")
+    return result
+
+
+def run_worker(spool: str, poll: float = 2.0, heartbeat: float = DEFAULT_HEARTBEAT,
+               stale_after: float = DEFAULT_STALE_AFTER, max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+               once: bool = False, **options) -> Iterator[JobResult]:
+    """
+    Worker daemon draining a spool directory shared by any number of
+    workers, on one machine or on several over a network file system;
+    there is no broker, every coordination step is an atomic rename.
+
+    The spool has four directories: incoming/ (queued jobs, see `submit`),
+    active/ (claimed jobs, see `Lease`), done/ and failed/, where every job
+    ends next to its <job>.result.json (the JobResult plus the worker,
+    attempt and timestamps). The worker claims the oldest job, runs it and
+    repeats; between jobs it returns stale leases of dead workers to the
+    queue (`recover_stale`). Stopping the worker with Ctrl+C puts its
+    current job back into incoming/.
+
+    :param spool: spool directory, created if missing
+    :param poll: seconds to wait for new jobs when the queue is empty
+    :param heartbeat: seconds between lease renewals
+    :param stale_after: seconds without a heartbeat after which a lease is taken back
+    :param max_attempts: claims of one job before it's failed
+    :param once: exit once the queue is empty and no worker holds a job, instead of waiting for more jobs
+    :param options: `make_sticker` options of every job (threads, cache, ...)
+    :return: iterator over the JobResults of the jobs this worker finished
+    """
+    logger = logging.getLogger("spool")
+    init_spool(spool)
+    worker = worker_id()
+    logger.info(f"Worker {worker} serving {spool}")
+    while True:
+        recover_stale(spool, stale_after, max_attempts)
+        lease = claim(spool, worker)
+        if lease is None:
+            if once and not os.listdir(os.path.join(spool, "active")):
+                return
+            time.sleep(poll)
+            continue
+        try:
+            result = run_job(lease, heartbeat, **options)
+        except BaseException:
+            lease.release()
+            raise
+        if result is not None:
+            yield result
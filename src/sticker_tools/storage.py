@@ -0,0 +1,69 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+
+def data_dir() -> Path:
+    """
+    Directory where sticker_tools keeps its local state (calibration, caches).
+    Can be overridden with the STICKER_TOOLS_HOME environment variable.
+    """
+    override = os.environ.get("STICKER_TOOLS_HOME")
+    if override:
+        base = Path(override)
+    elif sys.platform == "win32":
+        base = Path(os.environ.get("LOCALAPPDATA", Path.home())) / "sticker_tools"
+    else:
+        base = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "sticker_tools"
+    base.mkdir(parents=True, exist_ok=True)
+    return base
+
+
+def load_json(name: str, default=None):
+    """
+    Reads a JSON document from the data directory.
+
+    :param name: file name inside `data_dir()`
+    :param default: returned if the file doesn't exist or is corrupted
+    """
+    path = data_dir() / name
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def save_json(name: str, data) -> None:
+    """
+    Atomically writes a JSON document into the data directory.
+
+    :param name: file name inside `data_dir()`
+    :param data: JSON-serializable object
+    """
+    path = data_dir() / name
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    SHA-256 of the file content, read in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
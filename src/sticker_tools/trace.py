@@ -0,0 +1,140 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import List
+
+# output formats of `write_trace`
+TRACE_FORMATS = ("json", "chrome")
+
+_current = ContextVar("sticker_tools_tracer", default=None)
+# child process usage of the spans open in this context, innermost last
+_open = ContextVar("sticker_tools_spans", default=())
+_usage_lock = threading.Lock()
+
+
+def child_exited(rusage) -> None:
+    """
+    Adds the CPU time and peak RSS of a reaped child process (see
+    `process.reap`) to every span open in the calling context.
+    """
+    spans = _open.get()
+    if not spans:
+        return
+    cpu = rusage.ru_utime + rusage.ru_stime
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    maxrss = rusage.ru_maxrss // 1024 if os.uname().sysname == "Darwin" else rusage.ru_maxrss
+    with _usage_lock:
+        for usage in spans:
+            usage["child_cpu"] += cpu
+            usage["child_maxrss_kb"] = max(usage["child_maxrss_kb"], maxrss)
+
+
+class Tracer:
+    """
+    Collects timed spans and instant events of one job.
+
+    A span records the wall time, the total CPU time and the largest peak
+    RSS of the child processes (ffmpeg, ffprobe) that ran inside it, in the
+    same thread or in threads started with a copy of its context (segmented
+    encodes, variant targets). Every child is measured on its own when it's
+    reaped (see `process.reap`), so concurrent jobs don't see each other's
+    children; where that isn't available (Windows) both stay zero.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def _record(self, kind: str, name: str, started: float, wall: float, args: dict):
+        self.records.append(dict(kind=kind, name=name, ts=started, wall=wall, pid=os.getpid(),
+                                 tid=threading.get_ident(), args=args))
+
+    @contextmanager
+    def span(self, name: str, **args):
+        started = time.time()
+        begin = time.perf_counter()
+        usage = dict(child_cpu=0.0, child_maxrss_kb=0)
+        token = _open.set(_open.get() + (usage,))
+        try:
+            yield args
+        finally:
+            wall = time.perf_counter() - begin
+            _open.reset(token)
+            args.update(child_cpu=round(usage["child_cpu"], 6), child_maxrss_kb=usage["child_maxrss_kb"])
+            self._record("span", name, started, wall, args)
+
+    def event(self, name: str, **args):
+        self._record("event", name, time.time(), 0.0, args)
+
+
+def current() -> Tracer:
+    """
+    The tracer of the running job, None if tracing is off.
+    """
+    return _current.get()
+
+
+@contextmanager
+def tracing(tracer: Tracer = None):
+    """
+    Activates `tracer` (a new one by default) for the code in the block and the threads it starts via
+    `contextvars`-aware executors.
+    """
+    tracer = tracer or Tracer()
+    token = _current.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _current.reset(token)
+
+
+def span(name: str, **args):
+    """
+    Context manager timing the block as a span of the active tracer. The
+    yielded dict may be updated with more args. Without an active tracer
+    it's a no-op yielding a throwaway dict, so instrumented code pays only a
+    context variable lookup and can update the args either way.
+    """
+    tracer = _current.get()
+    if tracer is None:
+        return nullcontext({})
+    return tracer.span(name, **args)
+
+
+def event(name: str, **args) -> None:
+    """
+    Records an instant event (e.g. one search iteration) if tracing is on.
+    """
+    tracer = _current.get()
+    if tracer is not None:
+        tracer.event(name, **args)
+
+
+def write_trace(path: str, records: List[dict], fmt: str = "json") -> None:
+    """
+    Writes trace records of one or more jobs to a file.
+
+    :param path: output file
+    :param records: records of `Tracer.records`, possibly from several processes
+    :param fmt: "json" (records as they are) or "chrome" (trace event format
+        for chrome://tracing and Perfetto, one row per process and thread)
+    """
+    if fmt not in TRACE_FORMATS:
+        raise ValueError(f"Unknown trace format: {fmt}. Use one of {', '.join(TRACE_FORMATS)}")
+    records = sorted(records, key=lambda r: r["ts"])
+    if fmt == "json":
+        data = {"records": records}
+    else:
+        events = []
+        for r in records:
+            item = dict(name=r["name"], ts=r["ts"] * 1e6, pid=r["pid"], tid=r["tid"], args=r["args"])
+            if r["kind"] == "span":
+                item.update(ph="X", dur=r["wall"] * 1e6)
+            else:
+                item.update(ph="i", s="t")
+            events.append(item)
+        data = {"traceEvents": events, "displayTimeUnit": "ms"}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1)
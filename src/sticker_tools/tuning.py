@@ -0,0 +1,229 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import re
+import shutil
+import tempfile
+import time
+from typing import Dict, List, Sequence
+
+from .benchmark import BUNDLED_CLIP, SYNTHETIC_CLIPS, generate_clip
+from .convert_optimize import estimate_bitrate, ffmpeg_version, prepare_mezzanine, vp9_pass1, vp9_pass2
+from .probe import probe
+from .process import run
+from .profiles import EncoderProfile, PROFILES, DEFAULT_PROFILE, save_tuned
+from .storage import data_dir
+
+logging.basicConfig(level=logging.INFO)
+
+# reference clips of a tuning run: smooth, moving and noisy content
+DEFAULT_CLIPS = ("bundled", "motion", "noisy")
+# settings tried by default, every combination is a candidate profile
+DEFAULT_GRID: Dict[str, Sequence] = {
+    "speed": (1, 2, 3, 4, 5),
+    "tile_columns": (0, 1),
+    "lag_in_frames": (0, 25),
+}
+# a candidate may lose this much mean SSIM against the reference profile
+DEFAULT_TOLERANCE = 0.005
+
+
+def grid_profiles(grid: Dict[str, Sequence] = None) -> List[EncoderProfile]:
+    """
+    Candidate profiles: every combination of the `grid` values, all with
+    `-quality good` and the first pass at speed 4 or faster. Alt-ref frames
+    need look-ahead, so they're on exactly when `lag_in_frames` is.
+    """
+    grid = grid or DEFAULT_GRID
+    keys = list(grid)
+    profiles = []
+    for values in itertools.product(*(grid[key] for key in keys)):
+        settings = dict(zip(keys, values))
+        settings.setdefault("quality", "good")
+        settings.setdefault("analysis_speed", max(4, settings.get("speed", 0)))
+        if "lag_in_frames" in settings:
+            settings.setdefault("auto_alt_ref", int(settings["lag_in_frames"] > 0))
+        name = "-".join(f"{key}={value}" for key, value in zip(keys, values))
+        profiles.append(EncoderProfile(name, **settings))
+    return profiles
+
+
+def quality_metrics(encoded: str, reference: str) -> Dict[str, float]:
+    """
+    SSIM and PSNR of `encoded` against `reference`, measured by ffmpeg's
+    ssim and psnr filters in one decode of both files.
+
+    :return: {"ssim": mean SSIM of all planes, "psnr": mean PSNR in dB}
+    """
+    graph = "[0:v]split[e1][e2];[1:v]split[r1][r2];[e1][r1]ssim;[e2][r2]psnr"
+    cmd = ['ffmpeg', '-hide_banner', '-nostats', '-i', encoded, '-i', reference,
+           '-lavfi', graph, '-f', 'null', '-']
+    stderr = run(cmd, capture_output=True, text=True).stderr
+    ssim = re.search(r"SSIM .*All:([\d.]+)", stderr)
+    psnr = re.search(r"PSNR .*average:([\d.]+|inf)", stderr)
+    if not ssim or not psnr:
+        raise RuntimeError(f"ffmpeg reported no SSIM/PSNR for {encoded}")
+    return {"ssim": float(ssim.group(1)), "psnr": float(psnr.group(1))}
+
+
+def measure(profile: EncoderProfile, source: str, reference: str, directory: str, vid_bps: float,
+            threads: int = 0) -> dict:
+    """
+    Two-pass encode of `source` at `vid_bps` with `profile`: wall time of both passes, size and quality.
+    """
+    output = os.path.join(directory, "candidate.webm")
+    passlog = os.path.join(directory, "candidate")
+    started = time.perf_counter()
+    vp9_pass1(source, os.path.join(directory, "analysis.webm"), vid_bps, passlogfile=passlog, profile=profile,
+              threads=threads)
+    vp9_pass2(source, output, vid_bps, passlogfile=passlog, profile=profile, threads=threads)
+    seconds = time.perf_counter() - started
+    return dict(seconds=seconds, size_kb=os.path.getsize(output) / 1024, **quality_metrics(output, reference))
+
+
+def pareto_front(points: List[dict]) -> List[dict]:
+    """
+    Points no other point beats on time, size and SSIM at once (lower
+    seconds, lower size_kb, higher ssim; at least as good on all, better on one).
+    """
+    def dominates(a, b):
+        no_worse = a["seconds"] <= b["seconds"] and a["size_kb"] <= b["size_kb"] and a["ssim"] >= b["ssim"]
+        better = a["seconds"] < b["seconds"] or a["size_kb"] < b["size_kb"] or a["ssim"] > b["ssim"]
+        return no_worse and better
+
+    return sorted((p for p in points if not any(dominates(q, p) for q in points)), key=lambda p: p["seconds"])
+
+
+def choose_profile(points: List[dict], reference: dict, target_size_kb: float,
+                   tolerance: float = DEFAULT_TOLERANCE) -> dict:
+    """
+    The fastest point whose mean SSIM is within `tolerance` of the reference
+    and whose encodes stay under the target, the reference itself if none is faster.
+    """
+    good = [p for p in points
+            if p["ssim"] >= reference["ssim"] - tolerance and p["max_size_kb"] < target_size_kb]
+    return min(good + [reference], key=lambda p: p["seconds"])
+
+
+def run_tuning(clips: Sequence[str] = DEFAULT_CLIPS, directory: str = None, target_size_kb: float = 255,
+               grid: Dict[str, Sequence] = None, tolerance: float = DEFAULT_TOLERANCE, threads: int = 0) -> dict:
+    """
+    Encodes the reference clips with the default profile and every
+    candidate of `grid` on this machine, at the bitrate the search would
+    start from, and compares them by encode time, size and quality against
+    the lossless intermediate.
+
+    :param clips: "bundled" and keys of `benchmark.SYNTHETIC_CLIPS`
+    :param directory: where clips are generated, the data directory by default
+    :param tolerance: SSIM a candidate may lose against the default profile
+    :return: report with the machine, every candidate's means over the clips, the Pareto front
+        (names) and the chosen candidate
+    """
+    logger = logging.getLogger("tuning")
+    directory = directory or os.path.join(data_dir(), "benchmark")
+    reference_profile = PROFILES[DEFAULT_PROFILE]
+    candidates = [reference_profile] + grid_profiles(grid)
+    measurements = {profile.name: [] for profile in candidates}
+    for name in clips:
+        if name == "bundled":
+            source = str(BUNDLED_CLIP)
+        elif name in SYNTHETIC_CLIPS:
+            source = generate_clip(name, os.path.join(directory, "clips"))
+        else:
+            raise ValueError(f"Unknown clip: {name}. Use bundled or one of {', '.join(SYNTHETIC_CLIPS)}")
+        scratch = tempfile.mkdtemp(prefix="tuning.")
+        try:
+            info = probe(source)
+            mezzanine, mezzanine_info = prepare_mezzanine(source, scratch, info)
+            vid_bps = estimate_bitrate(mezzanine_info.duration, target_size_kb)
+            for profile in candidates:
+                logger.info(f"{name}: {profile.name}")
+                measurements[profile.name].append(measure(profile, mezzanine, mezzanine, scratch, vid_bps, threads))
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    points = []
+    for profile in candidates:
+        runs = measurements[profile.name]
+        points.append(dict(
+            profile=profile.to_dict(),
+            name=profile.name,
+            seconds=sum(r["seconds"] for r in runs) / len(runs),
+            size_kb=sum(r["size_kb"] for r in runs) / len(runs),
+            max_size_kb=max(r["size_kb"] for r in runs),
+            ssim=sum(r["ssim"] for r in runs) / len(runs),
+            psnr=sum(r["psnr"] for r in runs) / len(runs),
+        ))
+    reference = points[0]
+    for point in points:
+        point["speedup"] = reference["seconds"] / point["seconds"] if point["seconds"] else 0.0
+    chosen = choose_profile(points[1:], reference, target_size_kb, tolerance)
+    return dict(
+        created=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        machine=dict(platform=platform.platform(), python=platform.python_version(), cpus=os.cpu_count(),
+                     ffmpeg=ffmpeg_version()),
+        settings=dict(clips=list(clips), target_size_kb=target_size_kb, tolerance=tolerance, threads=threads),
+        points=points,
+        front=[p["name"] for p in pareto_front(points)],
+        chosen=chosen["name"],
+    )
+
+
+def format_report(report: dict) -> str:
+    """
+    Human-readable table of a tuning report, the Pareto front marked with *.
+    """
+    front = set(report["front"])
+    width = max(len(p["name"]) for p in report["points"])
+    lines = [f"  {'profile':<{width}} {'seconds':>8} {'speedup':>7} {'size kb':>8} {'ssim':>7} {'psnr':>6}",
+             "-" * (width + 44)]
+    for p in report["points"]:
+        mark = "*" if p["name"] in front else " "
+        lines.append(f"{mark} {p['name']:<{width}} {p['seconds']:>8.2f} {p['speedup']:>6.2f}x {p['size_kb']:>8.1f} "
+                     f"{p['ssim']:>7.4f} {p['psnr']:>6.2f}")
+    lines.append("-" * (width + 44))
+    lines.append(f"chosen: {report['chosen']}")
+    return "\n".join(lines)
+
+
+def _values(text: str) -> List[int]:
+    return [int(v) for v in text.split(",")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="sticker-tune",
+        description="Find the fastest encoder profile of this machine that keeps the quality of the default one.",
+    )
+    parser.add_argument("clips", nargs="*", default=list(DEFAULT_CLIPS),
+                        help=f"reference clips: bundled, {', '.join(SYNTHETIC_CLIPS)} "
+                             f"(default: {' '.join(DEFAULT_CLIPS)})")
+    parser.add_argument("--speeds", type=_values, default=DEFAULT_GRID["speed"], metavar="LIST",
+                        help="-speed values to try (default: 1,2,3,4,5)")
+    parser.add_argument("--tile-columns", type=_values, default=DEFAULT_GRID["tile_columns"], metavar="LIST",
+                        help="-tile-columns values to try (default: 0,1)")
+    parser.add_argument("--lag", type=_values, default=DEFAULT_GRID["lag_in_frames"], metavar="LIST",
+                        help="-lag-in-frames values to try (default: 0,25)")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="mean SSIM the chosen profile may lose (default: %(default)s)")
+    parser.add_argument("--target-size", type=float, default=255, metavar="KB")
+    parser.add_argument("--threads", type=int, default=0, help="encoder threads (default: automatic)")
+    parser.add_argument("--dir", help="working directory for the clips (default: the data directory)")
+    parser.add_argument("-o", "--output", metavar="FILE", help="save the report as JSON")
+    parser.add_argument("--dry-run", action="store_true", help="don't save the chosen profile as 'tuned'")
+    args = parser.parse_args(argv)
+    grid = {"speed": args.speeds, "tile_columns": args.tile_columns, "lag_in_frames": args.lag}
+    report = run_tuning(args.clips, args.dir, args.target_size, grid, args.tolerance, args.threads)
+    print(format_report(report), flush=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+    chosen = next(p for p in report["points"] if p["name"] == report["chosen"])
+    if not args.dry_run:
+        save_tuned(EncoderProfile(**chosen["profile"]), speedup=chosen["speedup"], ssim=chosen["ssim"],
+                   tuned=report["created"])
+        print(f"Saved {chosen['name']} ({chosen['speedup']:.2f}x) as the 'tuned' profile, "
+              f"use it with --profile tuned", flush=True)
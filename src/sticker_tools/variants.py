@@ -0,0 +1,229 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from dataclasses import dataclass
+from typing import List, Sequence
+
+from .bitrate_memo import BitrateMemo, warm_start
+from .cancel import Cancelled, CancelToken, scope
+from .convert_optimize import (estimate_bitrate, prepare_mezzanine, vp9_pass1, vp9_pass2, scratch_size,
+                               best_so_far, OvershootGuard)
+from .patch_duration import patch_duration
+from .pipeline import JobResult
+from .probe import probe, MediaInfo
+from .progress import reporter
+from .rate_control import search, Overshoot, Sample, SearchResult, fallback_bitrate
+from .scratch import job_scratch, promote, scratch_root
+from .storage import file_digest
+from . import trace as tracing
+
+logging.basicConfig(level=logging.INFO)
+
+
+@dataclass(slots=True)
+class Target:
+    """
+    One output of a multi-target job.
+
+    :param name: label of the output ("sticker", "emoji", ...)
+    :param size: side of the square output frame in pixels, at most 512
+    :param fps: frame rate cap
+    :param target_size_kb: upper limit of the output size
+    :param accuracy_kb: the search stops once the size is under the target by less than this
+    :param suffix: appended to the input file name (before .webm) to name the output
+    """
+    name: str
+    size: int = 512
+    fps: float = 30
+    target_size_kb: float = 255
+    accuracy_kb: float = 5
+    suffix: str = ""
+
+    def output_path(self, input_path: str) -> str:
+        return os.path.splitext(input_path)[0] + self.suffix + ".webm"
+
+
+# Telegram video sticker and custom emoji
+STICKER = Target("sticker")
+EMOJI = Target("emoji", size=100, target_size_kb=64, accuracy_kb=2, suffix="_emoji")
+DEFAULT_TARGETS = (STICKER, EMOJI)
+
+
+def target_filter(target: Target, source_info: MediaInfo):
+    """
+    Filter chain bringing the 512x512 intermediate to the target, None if it already matches.
+    """
+    if target.size > 512:
+        raise ValueError(f"Target {target.name} is larger than the 512x512 intermediate")
+    filters = []
+    if target.size != source_info.width:
+        filters.append(f"scale={target.size}:{target.size}:flags=bicubic")
+    if source_info.fps and target.fps < source_info.fps:
+        filters.append(f"fps={target.fps:g}")
+    return ",".join(filters) or None
+
+
+def _memo_name(target: Target) -> str:
+    # KB per second depends on the frame size and rate, not on the size limit
+    if target.size == 512 and target.fps >= 30:
+        return "bitrate_memo.json"
+    return f"bitrate_memo_{target.size}_{target.fps:g}.json"
+
+
+def _search_target(target: Target, input_path: str, info: MediaInfo, source: str, source_info: MediaInfo,
+                   scratch: str, digest: str, threads: int, memo: bool, early_abort: bool, strategy,
+                   max_encodes: int, event_callback, profile) -> SearchResult:
+    """
+    First pass and bitrate search of one target against the shared intermediate,
+    the accepted encode is promoted to the target's output path. A cancelled
+    search keeps its best encode so far, like `convert_optimize`. `info` is
+    the MediaInfo of the input, the bitrate memo knows the clip by it.
+    """
+    logger = logging.getLogger("variants")
+    directory = os.path.join(scratch, target.name)
+    os.makedirs(directory)
+    passlog = os.path.join(directory, "analysis")
+    options = dict(threads=threads, filters=target_filter(target, source_info), profile=profile)
+    frames = round(source_info.duration * min(source_info.fps or target.fps, target.fps))
+    trial_paths = []
+    # complete encodes so far, for a cancelled search
+    measured = []
+
+    def watch(stage, iteration=0, guard=None):
+        if event_callback is None:
+            return guard
+        return reporter(event_callback, f"{target.name} {stage}", iteration, frames, guard)
+
+    def encode(vid_bps, abortable=early_abort):
+        trial_path = os.path.join(directory, f"trial{len(trial_paths) + 1:02d}.webm")
+        trial_paths.append(trial_path)
+        started = time.perf_counter()
+        guard = OvershootGuard(target.target_size_kb, frames) if abortable else None
+        if not vp9_pass2(source, trial_path, vid_bps, passlogfile=passlog,
+                         on_progress=watch("encode", len(trial_paths), guard), **options):
+            raise Overshoot(guard.projected_kb)
+        size_kb = os.path.getsize(trial_path) / 1024
+        measured.append((Sample(vid_bps, size_kb, seconds=time.perf_counter() - started), trial_path))
+        return size_kb
+
+    duration = source_info.duration
+    bitrate_memo = BitrateMemo(_memo_name(target), profile=profile) if memo else None
+    seed = None
+    if bitrate_memo:
+        seed = warm_start(bitrate_memo.samples_for(input_path, info, digest),
+                          target.target_size_kb, target.accuracy_kb)
+    seed = seed or estimate_bitrate(duration, target.target_size_kb)
+
+    logger.info(f"{target.name}: first pass at {target.size}x{target.size}, {target.target_size_kb} kb")
+    vp9_pass1(source, os.path.join(directory, "analysis.webm"), seed, passlogfile=passlog,
+              on_progress=watch("analysis"), **options)
+    try:
+        result = search(encode, seed, target.target_size_kb, target.accuracy_kb, strategy=strategy,
+                        max_encodes=max_encodes)
+        if result.chosen is None:
+            # every trial was aborted over the target: finish one below them without the guard
+            bitrate = fallback_bitrate(result.samples, target.target_size_kb, target.accuracy_kb)
+            encode(bitrate, abortable=False)
+            result.settle(measured[-1][0], target.target_size_kb, target.accuracy_kb)
+        chosen_path = trial_paths[result.chosen]
+    except Cancelled as e:
+        result, chosen_path = best_so_far(e, measured, target.target_size_kb)
+    promote(chosen_path, target.output_path(input_path))
+    if bitrate_memo:
+        bitrate_memo.record(input_path, info, result.samples, digest)
+    logger.info(f"{target.name}: {result.size_kb:.2f} kb at {result.bitrate / 1000:.2f} kbps, "
+                f"{result.encodes} encodes")
+    return result
+
+
+def make_variants(input_path: str, targets: Sequence[Target] = DEFAULT_TARGETS, threads: int = 0,
+                  memo: bool = True, early_abort: bool = True, strategy="model", max_encodes: int = 10,
+                  mezzanine: str = "ffv1", sink: str = "ram", event_callback=None, trace: bool = False,
+                  cancel: CancelToken = None, timeout: float = None, profile: str = None) -> List[JobResult]:
+    """
+    Converts one clip into several outputs (e.g. a 512x512 sticker and a
+    100x100 emoji) in one job. The source is probed and decoded once into
+    the lossless intermediate of `prepare_mezzanine`; every target then runs
+    its own first pass and bitrate search against it, the searches in
+    parallel, and each output is patched with `patch_duration`. The encodes
+    of a small target cost a fraction of the sticker's, so extra variants
+    are nearly free.
+
+    Targets fail independently: a failed target comes back as a result
+    with status "error". Proxy calibration, segmented encodes and the result
+    cache are only available for single outputs (`pipeline.make_sticker`).
+
+    :param targets: outputs to produce
+    :param threads: encoder threads per target, 0 splits the cores between the targets
+    :param event_callback: receives ProgressEvents, their stage prefixed with the target name
+    :param trace: record the stages of the job into the `trace` of the first result
+    :param cancel: CancelToken to stop the job from another thread
+    :param timeout: time budget of the whole job in seconds; when it runs out every target keeps its best
+        under-target encode so far (status "timeout"), or fails with Cancelled if there is none
+    :param profile: encoder profile of every target (see `profiles`)
+    :return: one JobResult per target, in the order of `targets`
+    """
+    if trace:
+        with tracing.tracing() as tracer:
+            with tracing.span("job", input=input_path, targets=len(targets)):
+                results = make_variants(input_path, targets, threads, memo, early_abort, strategy, max_encodes,
+                                        mezzanine, sink, event_callback, cancel=cancel, timeout=timeout,
+                                        profile=profile)
+        # the job is traced once, the records go with its first result
+        results[0].trace = tracer.records
+        return results
+    if cancel is not None or timeout is not None:
+        token = cancel or CancelToken()
+        if timeout is not None:
+            token.timeout = timeout
+        with scope(token):
+            return make_variants(input_path, targets, threads, memo, early_abort, strategy, max_encodes,
+                                 mezzanine, sink, event_callback, profile=profile)
+
+    started = time.perf_counter()
+    threads = threads or max(1, (os.cpu_count() or 1) // len(targets))
+    first = targets[0].output_path(input_path)
+    info = probe(input_path)
+    # the targets share the intermediate, their trial encodes add up
+    needed = scratch_size(info, "ffv1", sum(target.target_size_kb for target in targets), max_encodes)
+    with job_scratch(first, scratch_root(sink, needed)) as scratch:
+        source, source_info = prepare_mezzanine(input_path, scratch, info, mezzanine or "ffv1")
+        digest = file_digest(input_path) if memo else None
+
+        def run_target(target):
+            return _search_target(target, input_path, info, source, source_info, scratch, digest, threads,
+                                  memo, early_abort, strategy, max_encodes, event_callback, profile)
+
+        # every target runs in a copy of this context, so it's traced and cancelled with the job
+        calls = [(copy_context(), target) for target in targets]
+        with ThreadPoolExecutor(max_workers=len(targets)) as pool:
+            futures = [pool.submit(context.run, run_target, target) for context, target in calls]
+
+        results = []
+        for target, future in zip(targets, futures):
+            output_path = target.output_path(input_path)
+            result = JobResult(input_path, output_path)
+            try:
+                search_result = future.result()
+                with tracing.span("patch", output=output_path):
+                    patch_duration(output_path)
+            except Cancelled as e:
+                result.status, result.error = e.reason, str(e)
+            except Exception as e:
+                result.status, result.error = "error", str(e)
+            else:
+                result.bitrate = search_result.bitrate
+                result.encodes = search_result.encodes
+                result.history = search_result.history()
+                result.size_kb = os.path.getsize(output_path) / 1024
+                if search_result.stopped:
+                    result.status = search_result.stopped
+                    result.error = f"stopped after {result.encodes} encodes, kept the best encode so far"
+                elif search_result.size_kb >= target.target_size_kb:
+                    result.status = "over_target"
+                    result.error = f"no encode fit under {target.target_size_kb} kb, kept the smallest"
+            result.seconds = time.perf_counter() - started
+            results.append(result)
+    return results
@@ -0,0 +1,327 @@
+import logging
+import mmap
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict, field
+from typing import Iterable, List, Tuple
+
+from .patch_duration import parse_vint, EBML_ID, SEGMENT_ID, INFO_ID, DURATION_ID, CLUSTER_ID
+
+logging.basicConfig(level=logging.INFO)
+
+# EBML element IDs used by the inspector, on top of those of patch_duration
+DOC_TYPE_ID = 0x4282
+TIMECODE_SCALE_ID = 0x2AD7B1
+TRACKS_ID = 0x1654AE6B
+TRACK_ENTRY_ID = 0xAE
+TRACK_NUMBER_ID = 0xD7
+TRACK_TYPE_ID = 0x83
+CODEC_ID = 0x86
+DEFAULT_DURATION_ID = 0x23E383
+VIDEO_ID = 0xE0
+PIXEL_WIDTH_ID = 0xB0
+PIXEL_HEIGHT_ID = 0xBA
+CUES_ID = 0x1C53BB6B
+CUE_POINT_ID = 0xBB
+TIMECODE_ID = 0xE7
+SIMPLE_BLOCK_ID = 0xA3
+BLOCK_GROUP_ID = 0xA0
+BLOCK_ID = 0xA1
+# children of a Cluster, to find the end of a cluster of unknown size
+CLUSTER_CHILDREN = {TIMECODE_ID, SIMPLE_BLOCK_ID, BLOCK_GROUP_ID, 0xA7, 0xAB, 0xAF, 0x5854}
+VIDEO_TRACK = 1
+
+# Telegram video sticker limits
+VIDEO_CODEC = "V_VP9"
+MAX_SIDE = 512
+MAX_FPS = 30
+MAX_SIZE_KB = 256
+MAX_DURATION = 3.0
+
+
+@dataclass(slots=True)
+class WebmReport:
+    """
+    Properties of one .webm file read from its element headers.
+
+    :param filename: the .webm file
+    :param status: "ok", "invalid" (see `problems`) or "error" (not a readable WebM file)
+    :param size_kb: file size in KB
+    :param codec: Matroska codec ID of the video track ("V_VP9", ...)
+    :param width: frame width in pixels
+    :param height: frame height in pixels
+    :param fps: frame rate, from the track's default frame duration or the block timestamps
+    :param frames: number of video frames (blocks of the video track)
+    :param duration: Duration element of the header (the patched value), seconds
+    :param true_duration: duration of the video from its block timestamps, seconds
+    :param cues: number of cue points (seek index entries)
+    :param problems: Telegram limits the file breaks
+    :param error: error message if the file couldn't be read
+    """
+    filename: str
+    status: str = "ok"
+    size_kb: float = None
+    codec: str = None
+    width: int = None
+    height: int = None
+    fps: float = None
+    frames: int = 0
+    duration: float = None
+    true_duration: float = None
+    cues: int = 0
+    problems: List[str] = field(default_factory=list)
+    error: str = None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _element(buf, pos: int) -> Tuple[int, int, int]:
+    """
+    Element at `pos` of the mapped file: ID, payload size (-1 if unknown)
+    and the position of the payload. Same rules as `read_element_header`,
+    without the file object round trips.
+    """
+    id_length = 9 - buf[pos].bit_length()
+    if not 1 <= id_length <= 4:
+        raise ValueError(f"Invalid EBML element ID at {pos}")
+    element_id = int.from_bytes(buf[pos:pos + id_length], "big")
+    size_idx = pos + id_length
+    if size_idx >= len(buf):
+        raise ValueError("Truncated EBML element size")
+    vint_length, size = parse_vint(buf, size_idx)
+    if size == (1 << (7 * vint_length)) - 1:
+        size = -1
+    return element_id, size, size_idx + vint_length
+
+
+def _children(buf, start: int, end: int):
+    pos = start
+    while pos < end:
+        element_id, size, payload = _element(buf, pos)
+        yield element_id, payload, size
+        pos = payload + size
+
+
+def _uint(buf, payload: int, size: int) -> int:
+    return int.from_bytes(buf[payload:payload + size], "big")
+
+
+def _float(buf, payload: int, size: int) -> float:
+    return struct.unpack(">f" if size == 4 else ">d", buf[payload:payload + size])[0]
+
+
+def _tracks(buf, start: int, end: int) -> dict:
+    # properties of the first video track
+    for element_id, payload, size in _children(buf, start, end):
+        if element_id != TRACK_ENTRY_ID:
+            continue
+        track = {}
+        for child_id, child, child_size in _children(buf, payload, payload + size):
+            if child_id == TRACK_NUMBER_ID:
+                track["number"] = _uint(buf, child, child_size)
+            elif child_id == TRACK_TYPE_ID:
+                track["type"] = _uint(buf, child, child_size)
+            elif child_id == CODEC_ID:
+                track["codec"] = bytes(buf[child:child + child_size]).rstrip(b"\0").decode("ascii", "replace")
+            elif child_id == DEFAULT_DURATION_ID:
+                track["default_duration"] = _uint(buf, child, child_size)
+            elif child_id == VIDEO_ID:
+                for video_id, value, value_size in _children(buf, child, child + child_size):
+                    if video_id == PIXEL_WIDTH_ID:
+                        track["width"] = _uint(buf, value, value_size)
+                    elif video_id == PIXEL_HEIGHT_ID:
+                        track["height"] = _uint(buf, value, value_size)
+        if track.get("type") == VIDEO_TRACK:
+            return track
+    return {}
+
+
+def _block_time(buf, payload: int) -> Tuple[int, int]:
+    # track number (a VINT) and the signed 16 bit timestamp relative to the cluster
+    vint_length, track = parse_vint(buf, payload)
+    return track, struct.unpack(">h", buf[payload + vint_length:payload + vint_length + 2])[0]
+
+
+class _Timeline:
+    def __init__(self, track: int = None):
+        self.track = track
+        self.frames = 0
+        self.first = None
+        self.last = None
+
+    def add(self, track: int, timestamp: int):
+        if self.track is not None and track != self.track:
+            return
+        self.frames += 1
+        self.first = timestamp if self.first is None else min(self.first, timestamp)
+        self.last = timestamp if self.last is None else max(self.last, timestamp)
+
+
+def _cluster(buf, start: int, end: int, timeline: _Timeline) -> int:
+    """
+    Counts the blocks of a cluster from their headers, returns the position after the cluster.
+    `end` is None for a cluster of unknown size, which ends at the first element that can't be its child.
+    """
+    limit = len(buf) if end is None else end
+    timecode = 0
+    pos = start
+    while pos < limit:
+        element_id, size, payload = _element(buf, pos)
+        if end is None and element_id not in CLUSTER_CHILDREN:
+            return pos
+        if element_id == TIMECODE_ID:
+            timecode = _uint(buf, payload, size)
+        elif element_id == SIMPLE_BLOCK_ID:
+            track, relative = _block_time(buf, payload)
+            timeline.add(track, timecode + relative)
+        elif element_id == BLOCK_GROUP_ID:
+            for child_id, child, _ in _children(buf, payload, payload + size):
+                if child_id == BLOCK_ID:
+                    track, relative = _block_time(buf, child)
+                    timeline.add(track, timecode + relative)
+        pos = payload + size
+    return limit
+
+
+def _walk(buf, report: WebmReport) -> None:
+    element_id, size, payload = _element(buf, 0)
+    if element_id != EBML_ID:
+        raise RuntimeError("Not an EBML file")
+    element_id, segment_size, pos = _element(buf, payload + size)
+    if element_id != SEGMENT_ID:
+        raise RuntimeError(f"Expected a Segment element, found 0x{element_id:X}")
+    end = pos + segment_size if segment_size >= 0 else len(buf)
+    end = min(end, len(buf))
+
+    timecode_scale = 1_000_000
+    track = {}
+    timeline = _Timeline()
+    while pos < end:
+        element_id, size, payload = _element(buf, pos)
+        if element_id == CLUSTER_ID:
+            if not timeline.frames and timeline.track is None:
+                timeline.track = track.get("number")
+            pos = _cluster(buf, payload, None if size < 0 else payload + size, timeline)
+            continue
+        if size < 0:
+            raise ValueError(f"Element 0x{element_id:X} of unknown size at {pos}")
+        if element_id == INFO_ID:
+            for child_id, child, child_size in _children(buf, payload, payload + size):
+                if child_id == TIMECODE_SCALE_ID:
+                    timecode_scale = _uint(buf, child, child_size)
+                elif child_id == DURATION_ID:
+                    report.duration = _float(buf, child, child_size) * timecode_scale / 1e9
+        elif element_id == TRACKS_ID:
+            track = _tracks(buf, payload, payload + size)
+        elif element_id == CUES_ID:
+            report.cues = sum(child_id == CUE_POINT_ID for child_id, _, _ in _children(buf, payload, payload + size))
+        pos = payload + size
+
+    report.codec = track.get("codec")
+    report.width = track.get("width")
+    report.height = track.get("height")
+    report.frames = timeline.frames
+    frame_seconds = track.get("default_duration", 0) / 1e9
+    if timeline.frames:
+        span = (timeline.last - timeline.first) * timecode_scale / 1e9
+        if not frame_seconds and timeline.frames > 1:
+            frame_seconds = span / (timeline.frames - 1)
+        report.true_duration = span + frame_seconds
+    if frame_seconds:
+        report.fps = 1 / frame_seconds
+
+
+def check(report: WebmReport, patched: bool = True) -> List[str]:
+    """
+    Telegram video sticker limits the file breaks: VP9, at most 512 px per
+    side, at most 30 fps, at most 256 KB, and (with `patched`) a header
+    Duration of at most 3 s.
+    """
+    problems = []
+    if report.codec != VIDEO_CODEC:
+        problems.append(f"codec {report.codec or 'missing'}, not VP9")
+    if (report.width or 0) > MAX_SIDE or (report.height or 0) > MAX_SIDE:
+        problems.append(f"{report.width}x{report.height} frame, larger than {MAX_SIDE}x{MAX_SIDE}")
+    if report.fps and report.fps > MAX_FPS + 0.01:
+        problems.append(f"{report.fps:.2f} fps, over {MAX_FPS}")
+    if report.size_kb > MAX_SIZE_KB:
+        problems.append(f"{report.size_kb:.2f} kb, over {MAX_SIZE_KB} kb")
+    if not report.frames:
+        problems.append("no video frames")
+    if patched and (report.duration is None or report.duration > MAX_DURATION):
+        duration = "no Duration" if report.duration is None else f"Duration {report.duration:.3f} s"
+        problems.append(f"{duration}, over {MAX_DURATION:g} s (not patched?)")
+    return problems
+
+
+def inspect(filename: str, patched: bool = True) -> WebmReport:
+    """
+    Reads the codec, frame size, frame rate, frame count, header Duration,
+    true duration and cue count of a .webm file and checks them against
+    Telegram's video sticker limits, without ffprobe.
+
+    The file is memory-mapped and only element headers are parsed: the
+    metadata elements are read, clusters are skipped block by block reading
+    just the block's track and timestamp, no frame is decoded. Errors are
+    reported in the result instead of being raised.
+
+    :param filename: the .webm file
+    :param patched: require a patched Duration (off to check a file before patching it)
+    :return: WebmReport
+    """
+    report = WebmReport(filename)
+    try:
+        report.size_kb = os.path.getsize(filename) / 1024
+        with open(filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            _walk(buf, report)
+    except (OSError, ValueError, RuntimeError, IndexError, struct.error) as e:
+        report.status, report.error = "error", str(e) or type(e).__name__
+        return report
+    report.problems = check(report, patched)
+    if report.problems:
+        report.status = "invalid"
+    return report
+
+
+def inspect_many(filenames: Iterable[str], workers: int = 8, patched: bool = True) -> List[WebmReport]:
+    """
+    Inspects many files concurrently (see `patch_many`). Results come back in the order of `filenames`.
+    """
+    logger = logging.getLogger("webm_inspect")
+    filenames = list(filenames)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        reports = list(pool.map(lambda name: inspect(name, patched), filenames))
+    logger.info(f"Inspected {_totals(reports)}")
+    return reports
+
+
+def _totals(reports: List[WebmReport]) -> str:
+    counts = {}
+    for report in reports:
+        counts[report.status] = counts.get(report.status, 0) + 1
+    return f"{len(reports)} files: " + ", ".join(f"{n} {status}" for status, n in sorted(counts.items()))
+
+
+def format_table(reports: List[WebmReport]) -> str:
+    """
+    Summary table of an inspection: one row per file and totals per status.
+    """
+    def number(value, spec):
+        return "-" if value is None else format(value, spec)
+
+    width = max([len("file")] + [len(r.filename) for r in reports])
+    header = f"{'file':<{width}}  {'codec':<6}  {'size':>9}  {'fps':>6}  {'frames':>6}  {'duration':>8}  {'true':>7}  status"
+    lines = [header, "-" * len(header)]
+    for r in reports:
+        size = f"{r.width}x{r.height}" if r.width else "-"
+        status = r.status
+        if r.error or r.problems:
+            status += ": " + (r.error or "; ".join(r.problems))
+        lines.append(f"{r.filename:<{width}}  {(r.codec or '-').replace('V_', ''):<6}  {size:>9}  "
+                     f"{number(r.fps, '.2f'):>6}  {r.frames:>6}  {number(r.duration, '.3f'):>8}  "
+                     f"{number(r.true_duration, '.3f'):>7}  {status}")
+    lines.append("-" * len(header))
+    lines.append(_totals(reports))
+    return "\n".join(lines)
@@ -0,0 +1,25 @@
+from sticker_tools.bitrate_memo import BitrateMemo
+from sticker_tools.probe import MediaInfo
+from sticker_tools.rate_control import Sample
+
+
+def _info(duration, width=512, height=512, fps=30.0):
+    return MediaInfo("clip.mp4", duration, width, height, fps, "h264", "yuv420p", round(duration * fps))
+
+
+def test_retrimmed_clip_gets_rescaled_samples(tmp_path, monkeypatch):
+    monkeypatch.setenv("STICKER_TOOLS_HOME", str(tmp_path))
+    memo = BitrateMemo()
+    memo.record("clip.mp4", _info(3.0), [Sample(600000, 240.0), Sample(900000, 300.0, partial=True)], "old")
+    # the same footage cut to 2 s: a new digest, found by name, geometry and duration
+    assert memo.samples_for("clip.mp4", _info(2.0), "new") == [Sample(600000, 160.0)]
+
+
+def test_other_geometry_or_long_edit_is_not_a_retrim(tmp_path, monkeypatch):
+    monkeypatch.setenv("STICKER_TOOLS_HOME", str(tmp_path))
+    memo = BitrateMemo()
+    memo.record("clip.mp4", _info(3.0), [Sample(600000, 240.0)], "old")
+    assert memo.samples_for("clip.mp4", _info(3.0, width=256), "new") == []
+    assert memo.samples_for("clip.mp4", _info(3.0, fps=60.0), "new") == []
+    assert memo.samples_for("clip.mp4", _info(9.0), "new") == []
+    assert memo.samples_for("other.mp4", _info(3.0), "new") == []
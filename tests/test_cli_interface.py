@@ -0,0 +1,18 @@
+from sticker_tools.cli_interface import _print_result
+from sticker_tools.pipeline import JobResult
+
+
+def test_print_result_timed_out_without_output(capsys):
+    # a job stopped before any encode fit under the target has no output to describe
+    result = JobResult("clip.mp4", "clip.webm", status="timeout", error="The job ran out of its 5 s time budget")
+    _print_result(result, as_json=False)
+    assert capsys.readouterr().out == "clip.mp4: timeout: The job ran out of its 5 s time budget\n"
+
+
+def test_print_result_timed_out_with_kept_encode(capsys):
+    result = JobResult("clip.mp4", "clip.webm", status="timeout", size_kb=250.0, bitrate=600000, encodes=2,
+                       seconds=5.0, error="stopped after 2 encodes, kept the best encode so far")
+    _print_result(result, as_json=False)
+    out = capsys.readouterr().out
+    assert out.startswith("clip.webm: 250.00 kb, 600.00 kbps, 2 encodes")
+    assert "(timeout: stopped after 2 encodes" in out
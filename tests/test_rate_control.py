@@ -0,0 +1,13 @@
+from sticker_tools.rate_control import Sample, _bracket
+
+
+def test_partial_sample_bounds_the_search_from_above():
+    low, high = _bracket([Sample(900, 250), Sample(1000, 300, partial=True)], 255)
+    assert (low.bitrate, high.bitrate) == (900, 1000)
+
+
+def test_partial_sample_contradicted_by_a_complete_encode_is_dropped():
+    # the extrapolation of a clip with a heavy start overshot, the complete encode above it fit
+    low, high = _bracket([Sample(1000, 300, partial=True), Sample(1100, 250)], 255)
+    assert low.bitrate == 1100
+    assert high is None